@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from call import Call  # noqa: E402
+from call_log import MODES, CallLogWriter  # noqa: E402
+from data_load import format_call_line  # noqa: E402
+
+CALLS = 50000
+
+
+def make_calls(count):
+    start = datetime(2025, 1, 1)
+    return [Call(f"0{11000000 + i % 5000}", f"0{22000000 + i % 7000}", start + timedelta(seconds=i), i % 3600) for i in range(count)]
+
+
+def bench_open_per_call(path, calls):
+    for call in calls:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(format_call_line(call))
+
+
+def bench_writer(path, calls, mode):
+    writer = CallLogWriter(path, mode=mode)
+    for call in calls:
+        writer.append(format_call_line(call))
+    writer.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else CALLS
+    calls = make_calls(count)
+    print(f"Appending {count} calls")
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [("open/close per call", lambda p: bench_open_per_call(p, calls))]
+        runs += [(f"CallLogWriter mode={mode}", lambda p, mode=mode: bench_writer(p, calls, mode)) for mode in MODES]
+        for label, run in runs:
+            path = os.path.join(tmp, label.replace(' ', '_').replace('/', '_') + '.txt')
+            start = time.perf_counter()
+            run(path)
+            elapsed = time.perf_counter() - start
+            with open(path, encoding='utf-8') as f:
+                assert sum(1 for _ in f) == count
+            print(f"{label:<28} {elapsed:8.3f} s  {count / elapsed:12,.0f} calls/s")
+
+
+if __name__ == "__main__":
+    main()
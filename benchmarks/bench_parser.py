@@ -0,0 +1,47 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from data_load import _parse_call_line_strptime, parse_call_line, parse_call_lines  # noqa: E402
+
+LINES = 200000
+
+
+def make_lines(count, seed=0):
+    rng = random.Random(seed)
+    numbers = [f"0{rng.randrange(10**8, 10**10)}" for _ in range(5000)]
+    numbers = [f"{n[:3]} {n[3:6]}-{n[6:]}" for n in numbers]
+    lines = []
+    for _ in range(count):
+        lines.append(
+            f"{rng.choice(numbers)}, {rng.choice(numbers)}, "
+            f"{rng.randint(1, 28):02d}.{rng.randint(1, 9):02d}.2025 "
+            f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}, "
+            f"{rng.randrange(10):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}\n"
+        )
+    return lines
+
+
+def bench(label, fn, lines):
+    start = time.perf_counter()
+    fn(lines)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f} s  {len(lines) / elapsed:12,.0f} lines/s")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    lines = make_lines(count)
+    print(f"Parsing {count} call lines")
+    base = bench("strptime parse_call_line", lambda ls: [_parse_call_line_strptime(l) for l in ls], lines)
+    single = bench("fast parse_call_line", lambda ls: [parse_call_line(l) for l in ls], lines)
+    bulk = bench("parse_call_lines (bulk)", parse_call_lines, lines)
+    print(f"Speedup: per-line {base / single:.1f}x, bulk {base / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+import data  # noqa: E402
+import data_load  # noqa: E402
+import persistence  # noqa: E402
+import datasets  # noqa: E402
+from call import Call  # noqa: E402
+from history import get_history_between, get_history_for  # noqa: E402
+from index import add_call_sorted  # noqa: E402
+from popularity_graph import update_on_call  # noqa: E402
+from search import autocomplete_names, did_you_mean_phone, search_by_firstname, search_by_phone  # noqa: E402
+from simulator import run_batched_simulation, run_overload_simulation  # noqa: E402
+
+RESULTS_VERSION = 1
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+QUERIES = 300
+INGEST_CALLS = 20000
+SIM_SECONDS = 5
+# A benchmark is a regression when its time per operation grows by more
+# than this share of the baseline.
+THRESHOLD = 0.10
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def timed(fn, ops):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'ops': ops}
+
+
+def timed_each(fn, args):
+    # Times fn once per argument; adds latency percentiles.
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    result = {'seconds': sum(samples), 'ops': len(samples)}
+    if samples:
+        result['p50_ms'] = samples[len(samples) // 2] * 1000
+        result['p95_ms'] = samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+    return result
+
+
+def point_data_at(directory):
+    data_load.PHONES_FILE_PATH = os.path.join(directory, 'phones.txt')
+    data_load.CALLS_FILE_PATH = os.path.join(directory, 'calls.txt')
+    data_load.BLOCKED_FILE_PATH = os.path.join(directory, 'blocked.txt')
+
+
+def reset_data():
+    data.phonebook = data.calls = data.blocked = data.call_index = data.popularity_graph = None
+
+
+def bench_loads(results, directory):
+    def load_source():
+        with quiet():
+            data_load.load_all_data(data_load.PHONES_FILE_PATH, data_load.CALLS_FILE_PATH, data_load.BLOCKED_FILE_PATH, workers=os.cpu_count())
+
+    calls = sum(1 for _ in open(data_load.CALLS_FILE_PATH, encoding='utf-8'))
+    results['load_source'] = timed(load_source, calls)
+    with quiet():
+        results['save_snapshot'] = timed(persistence.save_preprocessed, calls)
+        results['save_pickles'] = timed(persistence.save_pickles, calls)
+    for name, loader in (('load_snapshot', persistence.load_preprocessed), ('load_pickles', persistence.load_pickles)):
+        reset_data()
+        gc.collect()
+        with quiet():
+            results[name] = timed(loader, calls)
+
+
+def query_inputs(rng):
+    contacts = list(data.phonebook.items())
+    picked = [contact for _, contact in rng.sample(contacts, min(QUERIES, len(contacts)))]
+    name_prefixes = [contact.first_name[:rng.randint(1, 3)] for contact in picked]
+    phone_prefixes = [number[:rng.randint(3, 6)] for number, _ in rng.sample(contacts, min(QUERIES, len(contacts)))]
+    typos = []
+    for number, _ in rng.sample(contacts, min(QUERIES, len(contacts))):
+        pos = rng.randrange(1, len(number))
+        typos.append(number[:pos] + str((int(number[pos]) + 1) % 10) + number[pos + 1:])
+    store = data.calls.store
+    rows = data.calls.rows
+    sampled = [rows[rng.randrange(len(rows))] for _ in range(QUERIES)]
+    numbers = [store.numbers[store.callers[row]] for row in sampled]
+    pairs = [(store.numbers[store.callers[row]], store.numbers[store.callees[row]]) for row in sampled]
+    windows = []
+    for row in sampled:
+        start = datetime(1970, 1, 1) + timedelta(seconds=store.starts[row])
+        windows.append((store.numbers[store.callees[row]], start - timedelta(days=15), start + timedelta(days=15)))
+    return name_prefixes, phone_prefixes, typos, numbers, pairs, windows
+
+
+def bench_queries(results, rng):
+    name_prefixes, phone_prefixes, typos, numbers, pairs, windows = query_inputs(rng)
+    results['prefix_search_name'] = timed_each(lambda prefix: search_by_firstname(prefix)[:15], name_prefixes)
+    results['prefix_search_phone'] = timed_each(lambda prefix: search_by_phone(prefix)[:15], phone_prefixes)
+    results['autocomplete'] = timed_each(autocomplete_names, name_prefixes)
+    results['did_you_mean'] = timed_each(did_you_mean_phone, typos)
+    results['history_for'] = timed_each(get_history_for, numbers)
+    results['history_for_window'] = timed_each(lambda args: get_history_for(*args), windows)
+    results['history_between'] = timed_each(lambda pair: get_history_between(*pair), pairs)
+
+
+def bench_ingest(results, rng, scratch):
+    # Calls appended at runtime go to a scratch file, not the dataset.
+    data_load.CALLS_FILE_PATH = os.path.join(scratch, 'appended_calls.txt')
+    numbers = [number for number in data.phonebook if number not in data.blocked]
+    store = data.calls.store
+    first = datetime(1970, 1, 1) + timedelta(seconds=min(store.starts))
+    span = max(store.starts) - min(store.starts) + 1
+    calls = [Call(rng.choice(numbers), rng.choice(numbers), first + timedelta(seconds=rng.randrange(span)), rng.randrange(1, 3600)) for _ in range(INGEST_CALLS)]
+
+    def ingest():
+        for call in calls:
+            with data.lock:
+                add_call_sorted(call, data.calls, data.call_index)
+                update_on_call(call)
+
+    results['ingest_per_call'] = timed(ingest, len(calls))
+
+    for name, run in (('simulator', lambda: run_overload_simulation(SIM_SECONDS, enable_controls=False)),
+                      ('simulator_batched', lambda: run_batched_simulation(SIM_SECONDS))):
+        before = len(data.calls)
+        with quiet():
+            result = timed(run, 0)
+        result['ops'] = len(data.calls) - before
+        results[name] = result
+    data_load.flush_call_log()
+
+
+def run(args):
+    if args.scale not in datasets.SCALES:
+        raise SystemExit(f"Unknown scale {args.scale!r}; choose from {', '.join(datasets.SCALES)}")
+    directory = datasets.ensure(args.data_dir, args.scale, args.seed)
+    point_data_at(directory)
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        persistence.PREPROCESSED_DIR = os.path.join(scratch, 'preprocessed')
+        print(f"Running {args.scale} benchmarks on {directory}")
+        bench_loads(results, directory)
+        bench_queries(results, rng)
+        bench_ingest(results, rng, scratch)
+
+    for result in results.values():
+        result['ms_per_op'] = result['seconds'] * 1000 / result['ops'] if result['ops'] else None
+        result['ops_per_sec'] = result['ops'] / result['seconds'] if result['seconds'] else None
+    contacts, calls = datasets.SCALES[args.scale]
+    report = {
+        'version': RESULTS_VERSION,
+        'scale': args.scale,
+        'contacts': contacts,
+        'calls': calls,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    if args.baseline:
+        return compare_reports(load_report(args.baseline), report, args.threshold)
+    return 0
+
+
+def print_results(results):
+    print(f"\n{'benchmark':<22} {'seconds':>9} {'ops':>9} {'ms/op':>10} {'ops/s':>12} {'p95 ms':>9}")
+    for name, result in results.items():
+        ms = result['ms_per_op']
+        rate = result['ops_per_sec']
+        p95 = result.get('p95_ms')
+        print(f"{name:<22} {result['seconds']:9.3f} {result['ops']:9d} "
+              f"{ms if ms is not None else float('nan'):10.4f} {rate if rate is not None else float('nan'):12,.0f} "
+              f"{p95 if p95 is not None else float('nan'):9.3f}")
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('version') != RESULTS_VERSION:
+        raise SystemExit(f"{path}: unsupported results version {report.get('version')}")
+    return report
+
+
+def compare_reports(baseline, current, threshold):
+    # Compares time per operation; returns 1 if anything regressed.
+    if (baseline['scale'], baseline['seed']) != (current['scale'], current['seed']):
+        print(f"Warning: comparing {current['scale']}/seed {current['seed']} against {baseline['scale']}/seed {baseline['seed']}")
+    regressions = []
+    print(f"\n{'benchmark':<22} {'baseline ms/op':>15} {'current ms/op':>15} {'change':>9}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or not before.get('ms_per_op') or result.get('ms_per_op') is None:
+            print(f"{name:<22} {'-':>15} {result.get('ms_per_op') or float('nan'):15.4f} {'new':>9}")
+            continue
+        change = result['ms_per_op'] / before['ms_per_op'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<22} {before['ms_per_op']:15.4f} {result['ms_per_op']:15.4f} {change * 100:+8.1f}%{flag}")
+    for name in baseline['results']:
+        if name not in current['results']:
+            print(f"{name:<22} missing from the current results")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {threshold * 100:.0f}%: {', '.join(regressions)}")
+        return 1
+    print(f"\nNo regressions above {threshold * 100:.0f}%.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TelephoneCentral benchmark suite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="generate (or reuse) a dataset and run every benchmark")
+    run_parser.add_argument('--scale', default='small', help=f"one of {', '.join(datasets.SCALES)} (default: small)")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--data-dir', default=DATA_DIR, help="where generated datasets are kept")
+    run_parser.add_argument('--out', help="write results as JSON to this file")
+    run_parser.add_argument('--baseline', help="compare against a stored results file")
+    run_parser.add_argument('--threshold', type=float, default=THRESHOLD)
+
+    compare_parser = commands.add_parser('compare', help="compare two stored results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        return run(args)
+    return compare_reports(load_report(args.baseline), load_report(args.current), args.threshold)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
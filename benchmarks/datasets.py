@@ -0,0 +1,86 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_calls import generate_blocks, generate_calls  # noqa: E402
+
+# name -> (contacts, calls)
+SCALES = {
+    'tiny': (1000, 10000),
+    'small': (10000, 100000),
+    'medium': (100000, 1000000),
+    'large': (1000000, 10000000),
+}
+
+BLOCKED_SHARE = 0.002
+START_DATE = "01.01.2025"
+END_DATE = "31.12.2025"
+# Skewed popularity and office-hours traffic, closer to real use than a
+# uniform mix.
+ZIPF = 0.8
+CURVE = 'business'
+
+_SYLLABLES = ['an', 'be', 'ca', 'da', 'el', 'fi', 'go', 'ha', 'is', 'jo', 'ka', 'li', 'ma', 'ne', 'ol', 'pa',
+              'ra', 'si', 'ta', 'ul', 'va', 'wi', 'ya', 'zo', 'mar', 'kel', 'ton', 'ric', 'son', 'len']
+
+
+def _names(rng, count):
+    names = set()
+    while len(names) < count:
+        names.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(names)
+
+
+def _format_number(rng, digits):
+    # Same mix of separators as data/phones.txt, so loading exercises
+    # normalization.
+    layout = rng.randrange(3)
+    if layout == 0:
+        return digits
+    if layout == 1:
+        return f"{digits[:3]} {digits[3:6]}-{digits[6:]}"
+    return f"{digits[:4]}-{digits[4:]}"
+
+
+def _numbers(rng, count):
+    seen = set()
+    while len(seen) < count:
+        seen.add(f"0{rng.randrange(10**7, 10**10)}")
+    return [_format_number(rng, digits) for digits in sorted(seen)]
+
+
+def dataset_dir(root, scale, seed):
+    return os.path.join(root, f"{scale}-{seed}")
+
+
+def generate(directory, contacts, calls, seed=0):
+    # Writes phones.txt in the source format, then calls.txt and
+    # blocked.txt through generate_calls. The same arguments always produce
+    # the same files.
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    first_names = _names(rng, max(50, contacts // 50))
+    last_names = _names(rng, max(100, contacts // 10))
+    numbers = _numbers(rng, contacts)
+
+    with open(os.path.join(directory, 'phones.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(f"{rng.choice(first_names)} {rng.choice(last_names)},{number}\n" for number in numbers)
+
+    generate_blocks(numbers, os.path.join(directory, 'blocked.txt'), max(1, int(contacts * BLOCKED_SHARE)), seed)
+    # Written last and renamed into place, so a partial run is regenerated.
+    calls_path = os.path.join(directory, 'calls.txt')
+    generate_calls(numbers, calls_path + '.tmp', rows=calls, seed=seed, start=START_DATE, end=END_DATE, zipf=ZIPF, curve=CURVE)
+    os.replace(calls_path + '.tmp', calls_path)
+    return directory
+
+
+def ensure(root, scale, seed=0):
+    # Generates the dataset for scale/seed under root unless it is there.
+    directory = dataset_dir(root, scale, seed)
+    if not os.path.exists(os.path.join(directory, 'calls.txt')):
+        contacts, calls = SCALES[scale]
+        print(f"Generating {scale} dataset ({contacts} contacts, {calls} calls, seed {seed})...")
+        generate(directory, contacts, calls, seed)
+    return directory
@@ -1,87 +1,146 @@
+import argparse
 import random
 import time
+from datetime import datetime, timedelta
+from itertools import accumulate
 
 FILE_LENGTH = 1000000
-
-
-def str_time_prop(start, end, time_format, prop):
-    """Get a time at a proportion of a range of two formatted times.
-
-    start and end should be strings specifying times formatted in the
-    given format (strftime-style), giving an interval [start, end].
-    prop specifies how a proportion of the interval to be taken after
-    start.  The returned time will be in the specified format.
-    """
-
-    stime = time.mktime(time.strptime(start, time_format))
-    etime = time.mktime(time.strptime(end, time_format))
-
-    ptime = stime + prop * (etime - stime)
-
-    return time.strftime(time_format, time.localtime(ptime))
-
-
-def random_date(start, end, prop):
-    return str_time_prop(start, end, '%d.%m.%Y %H:%M:%S', prop)
-
-
-def random_duration(min, max):
-    duration = random.random()
-    minutes = random.randrange(0, 60)
-    seconds = random.randrange(0, 60)
-
-    hours = 0
-
-    if duration >= 0.9:
-        hours = random.randrange(min, max)
-
-    return "%02d:%02d:%02d" % (hours, minutes, seconds)
-
-
-def generate_calls():
-    with open("phones.txt") as input_file:
-        with open("calls.txt", "w") as output_file:
-            content = input_file.readlines()
-            for current_index in range(FILE_LENGTH):
-                date = random_date("01.01.2025 0:0:0",
-                                   "18.09.2025 23:59:59",
-                                   random.random())
-
-                duration = random_duration(0, 10)
-                while True:
-                    caller_index = random.randrange(0, len(content))
-                    callee_index = random.randrange(0, len(content))
-                    if caller_index != callee_index:
-                        break
-
-                caller_number = content[caller_index].replace("\n", "").split(",")[1]
-                callee_number = content[callee_index].replace("\n", "").split(",")[1]
-
-                data = [caller_number, callee_number, date, duration]
-                output_file.write(", ".join(data) + "\n")
-                print("%d/%d" % (current_index, FILE_LENGTH))
-
-
-def generate_blocks():
-    number_of_blocked = 100
-    choosen = set()
-
-    with open("phones.txt") as input_file:
-        with open("blocked.txt", "w") as output_file:
-            content = input_file.readlines()
-            while number_of_blocked > 0:
-                index = random.randint(0, len(content))
-                if index in choosen:
-                    continue
-
-                choosen.add(index)
-                number = content[index].split(",")[1]
-                output_file.write(number)
-                number_of_blocked -= 1
+START_DATE = "01.01.2025"
+END_DATE = "18.09.2025"
+BLOCKED_COUNT = 100
+
+# Rows generated per block; every column of a block is drawn with one
+# random.choices call.
+BLOCK_ROWS = 100000
+
+# Relative traffic per hour of the day, 00-23.
+CURVES = {
+    'flat': [1] * 24,
+    'business': [1, 1, 1, 1, 1, 2, 4, 8, 14, 18, 20, 20, 16, 18, 20, 20, 18, 14, 8, 5, 4, 3, 2, 1],
+    'residential': [3, 2, 1, 1, 1, 1, 2, 4, 6, 6, 6, 7, 8, 7, 6, 6, 7, 9, 12, 15, 16, 14, 10, 6],
+}
+
+# 'HH:MM:SS' for every second of a day; also used for durations below 24h.
+_CLOCK = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)]
+
+
+def load_numbers(phones_path):
+    """Phone numbers from a phones.txt file, exactly as written there."""
+    with open(phones_path, encoding='utf-8') as f:
+        return [line.rstrip('\n').split(',', 1)[1] for line in f if ',' in line]
+
+
+def zipf_cum_weights(count, exponent, rng):
+    """Cumulative weights giving the item at popularity rank r a weight of
+    1 / r**exponent; ranks are assigned to items at random. An exponent of 0
+    is uniform."""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(accumulate(1.0 / rank ** exponent for rank in ranks))
+
+
+def _days(start, end):
+    first = datetime.strptime(start, "%d.%m.%Y")
+    last = datetime.strptime(end, "%d.%m.%Y")
+    if last < first:
+        raise ValueError(f"End date {end} is before start date {start}")
+    return [(first + timedelta(days=i)).strftime("%d.%m.%Y") for i in range((last - first).days + 1)]
+
+
+def _block(rng, size, day_texts, numbers, caller_weights, callee_weights, hour_weights, sort_times):
+    # size rows of 'caller, callee, DD.MM.YYYY HH:MM:SS, HH:MM:SS'. day_texts
+    # is one date per row, or a single date for the whole block.
+    choices = rng.choices
+    callers = choices(numbers, cum_weights=caller_weights, k=size)
+    callees = choices(numbers, cum_weights=callee_weights, k=size)
+    for i in range(size):
+        # Nobody calls themselves; redraw the few collisions.
+        while callees[i] == callers[i]:
+            callees[i] = choices(numbers, cum_weights=callee_weights)[0]
+    hours = choices(range(24), cum_weights=hour_weights, k=size)
+    seconds = choices(range(3600), k=size)
+    times = [hour * 3600 + second for hour, second in zip(hours, seconds)]
+    if sort_times:
+        times.sort()
+    # As before: 90% of calls last under an hour, the rest 0-9 extra hours.
+    duration_hours = choices(range(10), weights=[91, 1, 1, 1, 1, 1, 1, 1, 1, 1], k=size)
+    duration_rest = choices(range(3600), k=size)
+    clock = _CLOCK
+    if isinstance(day_texts, str):
+        return [f"{caller}, {callee}, {day_texts} {clock[t]}, {clock[h * 3600 + r]}\n"
+                for caller, callee, t, h, r in zip(callers, callees, times, duration_hours, duration_rest)]
+    return [f"{caller}, {callee}, {day} {clock[t]}, {clock[h * 3600 + r]}\n"
+            for caller, callee, day, t, h, r in zip(callers, callees, day_texts, times, duration_hours, duration_rest)]
+
+
+def generate_calls(numbers, calls_path, rows=FILE_LENGTH, seed=0, start=START_DATE, end=END_DATE,
+                   zipf=0.0, callee_zipf=None, curve='flat', sorted_output=False, block_rows=BLOCK_ROWS):
+    """Writes rows random calls between numbers to calls_path.
+
+    zipf skews how often each number calls (callee_zipf, defaulting to
+    zipf, how often it is called); curve picks the hour-of-day profile from
+    CURVES. With sorted_output the file is in start-time order. The same
+    arguments and seed always give the same file."""
+    if len(numbers) < 2:
+        raise ValueError("Need at least 2 phone numbers to generate calls")
+    rng = random.Random(seed)
+    days = _days(start, end)
+    caller_weights = zipf_cum_weights(len(numbers), zipf, rng)
+    callee_weights = zipf_cum_weights(len(numbers), zipf if callee_zipf is None else callee_zipf, rng)
+    hour_weights = list(accumulate(CURVES[curve]))
+
+    with open(calls_path, 'w', encoding='utf-8') as output_file:
+        if sorted_output:
+            # Day by day, each day's start times sorted.
+            per_day = [rows // len(days)] * len(days)
+            for day in rng.sample(range(len(days)), rows % len(days)):
+                per_day[day] += 1
+            for day_text, count in zip(days, per_day):
+                if count:
+                    output_file.writelines(_block(rng, count, day_text, numbers, caller_weights, callee_weights, hour_weights, True))
+        else:
+            remaining = rows
+            while remaining:
+                size = min(block_rows, remaining)
+                remaining -= size
+                day_texts = rng.choices(days, k=size)
+                output_file.writelines(_block(rng, size, day_texts, numbers, caller_weights, callee_weights, hour_weights, False))
+
+
+def generate_blocks(numbers, blocked_path, count=BLOCKED_COUNT, seed=0):
+    """Writes count distinct numbers, picked at random, to blocked_path."""
+    # Its own stream, so the blocked list does not depend on the calls.
+    rng = random.Random(f"blocked-{seed}")
+    with open(blocked_path, 'w', encoding='utf-8') as output_file:
+        output_file.writelines(f"{number}\n" for number in rng.sample(numbers, min(count, len(numbers))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a random calls.txt (and blocked.txt) from phones.txt")
+    parser.add_argument('--phones', default='phones.txt')
+    parser.add_argument('--calls', default='calls.txt')
+    parser.add_argument('--blocked', default='blocked.txt')
+    parser.add_argument('--rows', type=int, default=FILE_LENGTH)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default=START_DATE, help="first day, DD.MM.YYYY")
+    parser.add_argument('--end', default=END_DATE, help="last day, DD.MM.YYYY")
+    parser.add_argument('--zipf', type=float, default=0.0, help="caller popularity skew; 0 is uniform, ~1 is Zipf")
+    parser.add_argument('--callee-zipf', type=float, help="callee popularity skew (default: --zipf)")
+    parser.add_argument('--curve', choices=sorted(CURVES), default='flat', help="hour-of-day traffic profile")
+    parser.add_argument('--sorted', action='store_true', help="write calls in start-time order")
+    parser.add_argument('--blocked-count', type=int, default=BLOCKED_COUNT, help="0 leaves blocked.txt alone")
+    args = parser.parse_args()
+
+    numbers = load_numbers(args.phones)
+    started = time.perf_counter()
+    generate_calls(numbers, args.calls, rows=args.rows, seed=args.seed, start=args.start, end=args.end,
+                   zipf=args.zipf, callee_zipf=args.callee_zipf, curve=args.curve, sorted_output=args.sorted)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {args.rows} calls to {args.calls} in {elapsed:.1f}s ({args.rows / elapsed if elapsed else 0:,.0f} rows/s)")
+    if args.blocked_count:
+        generate_blocks(numbers, args.blocked, args.blocked_count, args.seed)
+        print(f"Wrote {args.blocked_count} blocked numbers to {args.blocked}")
 
 
 if __name__ == '__main__':
-    generate_calls()
-    generate_blocks()
-
-
+    main()
@@ -1,34 +1,99 @@
-from data_load import parse_call_line, append_call_to_file
+import time
+from itertools import islice
+
+from data_load import parse_call_lines, append_records_to_file
 from call import Call
+from call_store import from_epoch
 import data
-from popularity_graph import update_on_call
-from index import add_call_sorted
+from popularity_graph import record_calls
+from index import add_records_sorted
+
+# Lines read, parsed and committed together.
+CHUNK_LINES = 200000
+
+# Per-line output: "all" prints every call, "errors" only skipped lines,
+# "summary" nothing but the final summary.
+LOG_LEVELS = ("all", "errors", "summary")
+
+
+def _read_chunks(f, chunk_lines):
+	# Yields (number of the first line, lines) for each chunk.
+	first_line = 1
+	while True:
+		lines = list(islice(f, chunk_lines))
+		if not lines:
+			return
+		yield first_line, lines
+		first_line += len(lines)
+
 
-def call_from_file(filepath_callsim, blocked_nums):
+def call_from_file(filepath_callsim, blocked_nums, log="errors", chunk_lines=CHUNK_LINES):
+
+	# Streams the file through read -> parse -> filter blocked -> sort ->
+	# merge, one chunk at a time: each chunk is merged into data.calls and
+	# the index in one pass, recorded in the graph in one pass and appended
+	# to calls.txt in one write.
+	if log not in LOG_LEVELS:
+		raise ValueError(f"log must be one of {LOG_LEVELS}, not {log!r}")
 	blocked_set = blocked_nums
 	total = 0
 	skipped = 0
 	processed = 0
+	stages = {"read": 0.0, "parse": 0.0, "filter": 0.0, "sort": 0.0, "merge": 0.0, "graph": 0.0, "write": 0.0}
+	start = time.perf_counter()
 	with open(filepath_callsim, 'r', encoding='utf-8') as f:
-		for line_num, line in enumerate(f, start=1):
-			try:
-				result = parse_call_line(line)
-				if result is None:
-					continue
-				caller, callee, timestamp, duration_secs = result
-				if caller in blocked_set or callee in blocked_set:
-					print(f"[BLOCKED] Skipping call at line {line_num}: {caller} → {callee} (blocked number)")
-					skipped += 1
-					continue
-				call = Call(caller, callee, timestamp, duration_secs)
-				print(f"[OK] {call}")
-				add_call_sorted(call, data.calls, data.call_index)
-				update_on_call(call)
-				append_call_to_file(call)
-				processed += 1
-			except Exception as e:
-				print(f"[ERROR] Skipping line {line_num}: {e}")
-				skipped += 1
-			total += 1
-	print(f"\nSummary: Processed {processed} calls, Skipped {skipped} calls (blocked or error), Total lines: {total}")
+		chunks = _read_chunks(f, chunk_lines)
+		while True:
+			t0 = time.perf_counter()
+			chunk = next(chunks, None)
+			if chunk is None:
+				break
+			first_line, lines = chunk
+			t1 = time.perf_counter()
+			line_nums = [] if log != "summary" else None
+			parsed, errors = parse_call_lines(lines, first_line, line_nums)
+			t2 = time.perf_counter()
+			records = [r for r in parsed if r[0] not in blocked_set and r[1] not in blocked_set]
+			t3 = time.perf_counter()
+			records.sort(key=lambda r: r[2])
+			t4 = time.perf_counter()
+			with data.lock:
+				add_records_sorted(records, data.calls, data.call_index)
+				t5 = time.perf_counter()
+				record_calls([(caller, callee, duration) for caller, callee, _, duration in records])
+				t6 = time.perf_counter()
+				append_records_to_file(records)
+			t7 = time.perf_counter()
+
+			stages["read"] += t1 - t0
+			stages["parse"] += t2 - t1
+			stages["filter"] += t3 - t2
+			stages["sort"] += t4 - t3
+			stages["merge"] += t5 - t4
+			stages["graph"] += t6 - t5
+			stages["write"] += t7 - t6
+			total += len(parsed) + len(errors)
+			processed += len(records)
+			skipped += len(parsed) - len(records) + len(errors)
 
+			if log != "summary":
+				# Skipped lines in file order.
+				skips = [(line_num, f"[ERROR] Skipping line {line_num}: {e}") for line_num, e in errors]
+				if len(records) < len(parsed):
+					for (caller, callee, _, _), line_num in zip(parsed, line_nums):
+						if caller in blocked_set or callee in blocked_set:
+							skips.append((line_num, f"[BLOCKED] Skipping call at line {line_num}: {caller} → {callee} (blocked number)"))
+				skips.sort(key=lambda skip: skip[0])
+				for _, message in skips:
+					print(message)
+			if log == "all":
+				for caller, callee, start_epoch, duration in records:
+					print(f"[OK] {Call(caller, callee, from_epoch(start_epoch), duration)}")
+
+	wall = time.perf_counter() - start
+	print(f"\nSummary: Processed {processed} calls, Skipped {skipped} calls (blocked or error), Total lines: {total}")
+	print(f"Ingested in {wall:.2f}s ({total / wall if wall else 0:.0f} lines/s)")
+	busy = sum(stages.values())
+	for stage, seconds in stages.items():
+		share = (seconds / busy * 100) if busy else 0.0
+		print(f"  {stage:<7} {seconds:8.3f}s  {share:5.1f}%")
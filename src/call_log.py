@@ -0,0 +1,126 @@
+import atexit
+import os
+import threading
+
+# Durability modes for CallLogWriter:
+#   'call'     - write and flush every line as it is appended
+#   'interval' - buffer lines and flush them together every interval_ms
+#   'fsync'    - like 'interval', but fsync the file after every batch
+MODES = ('call', 'interval', 'fsync')
+
+
+class CallLogWriter:
+    # Keeps calls.txt open and appends lines in batches. The buffer is
+    # bounded: once it holds max_buffer lines the appending thread flushes
+    # it itself instead of waiting for the background thread.
+    #
+    # A batch that fails to write is cut off the file again and put back at
+    # the front of the buffer, so the next flush retries it, and the error
+    # is raised to whoever flushed (the background thread only warns).
+
+    def __init__(self, path, mode='interval', interval_ms=50, max_buffer=4096):
+        if mode not in MODES:
+            raise ValueError(f"Unknown call log mode '{mode}'; expected one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.interval = interval_ms / 1000.0
+        self.max_buffer = max_buffer
+        self.lines_written = 0
+        self.batches_written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        # Unbuffered, so a failed write leaves nothing behind to be written
+        # later on its own.
+        self._file = open(path, 'ab', buffering=0)
+        self._thread = None
+        if mode != 'call':
+            self._thread = threading.Thread(target=self._run, name='call-log-writer', daemon=True)
+            self._thread.start()
+
+    def append(self, line):
+        with self._lock:
+            if self._closed:
+                raise ValueError("Call log is closed")
+            self._buffer.append(line)
+            if self.mode == 'call' or len(self._buffer) >= self.max_buffer:
+                self._write_buffer()
+
+    def extend(self, lines):
+        with self._lock:
+            if self._closed:
+                raise ValueError("Call log is closed")
+            self._buffer.extend(lines)
+            if self.mode == 'call' or len(self._buffer) >= self.max_buffer:
+                self._write_buffer()
+
+    def flush(self):
+        with self._lock:
+            self._write_buffer()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._write_buffer()
+            self._closed = True
+            self._file.close()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        fd = self._file.fileno()
+        end = os.fstat(fd).st_size
+        lines = self._buffer
+        self._buffer = []
+        try:
+            batch = memoryview(''.join(lines).encode('utf-8'))
+            while batch:
+                batch = batch[self._file.write(batch):]
+            if self.mode == 'fsync':
+                os.fsync(fd)
+        except OSError:
+            try:
+                # No torn line: drop whatever part of the batch got written.
+                os.ftruncate(fd, end)
+            except OSError:
+                pass
+            self._buffer[:0] = lines
+            raise
+        self.lines_written += len(lines)
+        self.batches_written += 1
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            with self._lock:
+                if self._closed:
+                    return
+                try:
+                    self._write_buffer()
+                except OSError as e:
+                    print(f"Warning: Failed to append {len(self._buffer)} calls to file (will retry): {e}")
+
+
+_writers = []
+
+
+def _close_all():
+    for writer in _writers:
+        try:
+            writer.close()
+        except OSError as e:
+            print(f"Warning: Failed to write {len(writer._buffer)} buffered calls to {writer.path}: {e}")
+
+
+atexit.register(_close_all)
+
+
+def open_call_log(path, mode='interval', interval_ms=50, max_buffer=4096):
+    writer = CallLogWriter(path, mode=mode, interval_ms=interval_ms, max_buffer=max_buffer)
+    _writers.append(writer)
+    return writer
@@ -0,0 +1,200 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort_right
+from datetime import datetime, timedelta
+
+from call import Call
+from segmented_rows import SegmentedRows
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def to_epoch(dt):
+    return (dt - _EPOCH) // _SECOND
+
+
+def to_epoch_ceil(dt):
+    # Rounds a fractional second up: the first whole second not before dt,
+    # for the lower bound of a time range.
+    return -((_EPOCH - dt) // _SECOND)
+
+
+def from_epoch(seconds):
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+class CallStore:
+    # One row per call, stored column-wise. Phone numbers are interned to
+    # integer ids and start times are kept as epoch seconds; Call objects
+    # are only built when a row is read.
+
+    def __init__(self):
+        self.numbers = []
+        self.number_ids = {}
+        self.callers = array('i')
+        self.callees = array('i')
+        self.starts = array('q')
+        self.durations = array('q')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intern(self, number):
+        number_id = self.number_ids.get(number)
+        if number_id is None:
+            number_id = len(self.numbers)
+            self.number_ids[number] = number_id
+            self.numbers.append(number)
+        return number_id
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('callers', 'callees'):
+            state[name] = array('i', state[name])
+        for name in ('starts', 'durations'):
+            state[name] = array('q', state[name])
+        return state
+
+    def _thaw(self):
+        # Columns opened from a snapshot are read-only memoryviews; copy
+        # them into arrays before the first write.
+        self.callers = array('i', self.callers)
+        self.callees = array('i', self.callees)
+        self.starts = array('q', self.starts)
+        self.durations = array('q', self.durations)
+
+    def add(self, caller, callee, start, duration):
+        if type(self.starts) is not array:
+            self._thaw()
+        row = len(self.starts)
+        self.callers.append(self.intern(caller))
+        self.callees.append(self.intern(callee))
+        self.starts.append(start)
+        self.durations.append(int(duration))
+        return row
+
+    def add_many(self, records):
+        # Bulk add for (caller, callee, start, duration) records: each
+        # column is extended once. Returns the new rows as an array.
+        if type(self.starts) is not array:
+            self._thaw()
+        first = len(self.starts)
+        number_ids = self.number_ids
+        intern = self.intern
+        self.callers.extend([number_ids[caller] if caller in number_ids else intern(caller) for caller, _, _, _ in records])
+        self.callees.extend([number_ids[callee] if callee in number_ids else intern(callee) for _, callee, _, _ in records])
+        self.starts.extend([start for _, _, start, _ in records])
+        self.durations.extend([int(duration) for _, _, _, duration in records])
+        return array('I', range(first, len(self.starts)))
+
+    def add_call(self, call):
+        return self.add(call.caller, call.callee, to_epoch(call.start), call.duration)
+
+    def call(self, row):
+        return Call(
+            self.numbers[self.callers[row]],
+            self.numbers[self.callees[row]],
+            from_epoch(self.starts[row]),
+            self.durations[row],
+        )
+
+
+class CallTimeline:
+    # Time-ordered view over a CallStore: an array of row ids sorted by
+    # start time. Indexing and iteration yield Call objects.
+
+    def __init__(self, store, rows=None):
+        self.store = store
+        self.rows = rows if rows is not None else array('I')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self.store.call(row) for row in self.rows[pos]]
+        return self.store.call(self.rows[pos])
+
+    def __iter__(self):
+        call = self.store.call
+        for row in self.rows:
+            yield call(row)
+
+    def bisect_left(self, start):
+        return bisect_left(self.rows, start, key=self.store.starts.__getitem__)
+
+    def bisect_right(self, start):
+        return bisect_right(self.rows, start, key=self.store.starts.__getitem__)
+
+    def __getstate__(self):
+        return {'store': self.store, 'rows': array('I', self.rows)}
+
+    def _thaw(self):
+        if type(self.rows) is not array:
+            self.rows = array('I', self.rows)
+        return self.rows
+
+    def add_row(self, row):
+        starts = self.store.starts
+        rows = self._thaw()
+        if not rows or starts[row] >= starts[rows[-1]]:
+            rows.append(row)
+        else:
+            insort_right(rows, row, key=starts.__getitem__)
+
+    def merge_rows(self, new_rows):
+        # new_rows must be sorted by start; like add_row for each of them,
+        # but touches only the part of the list at or after the first new
+        # start.
+        if not new_rows:
+            return
+        starts = self.store.starts
+        key = starts.__getitem__
+        rows = self._thaw()
+        if not rows or starts[new_rows[0]] >= starts[rows[-1]]:
+            rows.extend(new_rows)
+            return
+        pos = bisect_right(rows, starts[new_rows[0]], key=key)
+        # Two sorted runs: Timsort merges them in one pass, and being
+        # stable keeps existing rows ahead of new ones with the same start.
+        tail = rows[pos:]
+        tail.extend(new_rows)
+        rows[pos:] = array('I', sorted(tail, key=key))
+
+    def sort(self):
+        self._thaw()[:] = array('I', sorted(self.rows, key=self.store.starts.__getitem__))
+
+
+class SegmentedTimeline(CallTimeline):
+    # The global timeline. Rows stay a flat array (or snapshot memoryview)
+    # while loaded and read, and move into a SegmentedRows on the first
+    # write, so out-of-order inserts no longer shift the whole list.
+    # The call index moves its long per-number lists into SegmentedRows
+    # the same way and wraps them in this class for reads.
+
+    def _segmented(self):
+        rows = self.rows
+        if type(rows) is not SegmentedRows:
+            rows = self.rows = SegmentedRows(rows, self.store.starts.__getitem__)
+        return rows
+
+    def bisect_left(self, start):
+        rows = self.rows
+        if type(rows) is SegmentedRows:
+            return rows.bisect_left(start, self.store.starts.__getitem__)
+        return super().bisect_left(start)
+
+    def bisect_right(self, start):
+        rows = self.rows
+        if type(rows) is SegmentedRows:
+            return rows.bisect_right(start, self.store.starts.__getitem__)
+        return super().bisect_right(start)
+
+    def add_row(self, row):
+        self._segmented().insert(row, self.store.starts.__getitem__)
+
+    def merge_rows(self, new_rows):
+        self._segmented().merge(new_rows, self.store.starts.__getitem__)
+
+    def sort(self):
+        self.rows = array('I', sorted(self.rows, key=self.store.starts.__getitem__))
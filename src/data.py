@@ -1,4 +1,6 @@
-import pytrie
+import threading
+
+from radix_trie import RadixTrie
 
 
 phonebook = None
@@ -12,9 +14,38 @@ call_index = None
 
 popularity_graph = None
 
-firstname_trie = pytrie.StringTrie()
-lastname_trie = pytrie.StringTrie()
-phone_trie = pytrie.StringTrie()
+# Held while calls, call_index and popularity_graph are updated, and while
+# a snapshot copies them.
+lock = threading.RLock()
+
+# Clear while calls, call_index and popularity_graph are still being loaded
+# in the background (see startup.py); calls_error holds the reason if that
+# load failed.
+calls_ready = threading.Event()
+calls_ready.set()
+calls_error = None
+
+# Identifies the phonebook/tries/blocked contents last written to a
+# snapshot; None means they have not been saved since they were loaded.
+static_token = None
+
+firstname_trie = RadixTrie()
+lastname_trie = RadixTrie()
+phone_trie = RadixTrie()
+
+# Edit-distance index over phonebook numbers, for "did you mean".
+phone_edit_index = None
+
+# Trigram indexes over the lower-cased name trie keys, for fuzzy search.
+firstname_ngrams = None
+lastname_ngrams = None
+
+
+def reset_tries():
+    global firstname_trie, lastname_trie, phone_trie
+    firstname_trie = RadixTrie()
+    lastname_trie = RadixTrie()
+    phone_trie = RadixTrie()
 
 
 def init_popularity_graph(graph):
@@ -1,11 +1,43 @@
+from array import array
 from datetime import datetime
+import io
+from itertools import islice
 import os
-from call import Call
+from call_log import open_call_log
+from call_store import CallStore, SegmentedTimeline, from_epoch, to_epoch
 from contact import Contact
 from trie import insert_firstname, insert_lastname, insert_phone
+from edit_index import EditDistanceIndex
+from ngram_index import TrigramIndex
 import data
-
-CALLS_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'calls.txt')
+import metrics
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+CALLS_FILE_PATH = os.path.join(DATA_DIR, 'calls.txt')
+PHONES_FILE_PATH = os.path.join(DATA_DIR, 'phones.txt')
+BLOCKED_FILE_PATH = os.path.join(DATA_DIR, 'blocked.txt')
+
+# How calls appended at runtime reach calls.txt; see call_log.MODES.
+CALL_LOG_MODE = 'interval'
+CALL_LOG_INTERVAL_MS = 50
+_call_log = None
+
+# Files smaller than this are not worth starting a process pool for.
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+CHUNKS_PER_WORKER = 4
+CALL_BLOCK_LINES = 65536
+
+# Caches for the fast call-line parser: raw phone field -> normalized
+# number, 'DD.MM.YYYY' -> epoch seconds at midnight, ' HH:MM:SS' -> seconds
+# since midnight and 'HH:MM:SS' -> duration in seconds.
+_PARSE_CACHE_LIMIT = 1 << 20
+_phone_cache = {}
+_date_cache = {}
+_clock_cache = {}
+_duration_cache = {}
+
+# Epoch day number -> 'DD.MM.YYYY', for format_epoch_record.
+_day_text_cache = {}
 
 class PhoneNormalizationError(Exception):
     pass
@@ -46,7 +78,7 @@ def parse_phone_line(line):
     return firstname, lastname, normalized_phone
 
 
-def parse_call_line(line):
+def _parse_call_line_strptime(line):
 
     line = line.strip()
 
@@ -92,6 +124,132 @@ def parse_call_line(line):
     return caller_normalized, callee_normalized, timestamp, duration_secs
 
 
+def _remember(cache, key, value):
+    if len(cache) >= _PARSE_CACHE_LIMIT:
+        cache.clear()
+    cache[key] = value
+    return value
+
+
+def _hms(text):
+    if len(text) != 8 or text[2] != ':' or text[5] != ':':
+        return None
+    digits = text[0:2] + text[3:5] + text[6:8]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    return int(digits[0:2]), int(digits[2:4]), int(digits[4:6])
+
+
+def _cached_phone(raw):
+    try:
+        normalized = normalize_phone(raw.strip())
+    except ValueError:
+        return None
+    return _remember(_phone_cache, raw, normalized)
+
+
+def _cached_date(date_str):
+    if len(date_str) != 10 or date_str[2] != '.' or date_str[5] != '.':
+        return None
+    digits = date_str[0:2] + date_str[3:5] + date_str[6:10]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    try:
+        day_start = to_epoch(datetime(int(digits[4:8]), int(digits[2:4]), int(digits[0:2])))
+    except ValueError:
+        return None
+    return _remember(_date_cache, date_str, day_start)
+
+
+def _cached_clock(clock_str):
+    if clock_str[:1] != ' ':
+        return None
+    hms = _hms(clock_str[1:])
+    if hms is None or hms[0] > 23 or hms[1] > 59 or hms[2] > 59:
+        return None
+    return _remember(_clock_cache, clock_str, hms[0] * 3600 + hms[1] * 60 + hms[2])
+
+
+def _cached_duration(duration_str):
+    hms = _hms(duration_str)
+    if hms is None:
+        return None
+    return _remember(_duration_cache, duration_str, hms[0] * 3600 + hms[1] * 60 + hms[2])
+
+
+def parse_call_record(line):
+    # Same result and errors as parse_call_line, but the start time is
+    # returned as epoch seconds. Lines in the usual 'DD.MM.YYYY HH:MM:SS' /
+    # 'HH:MM:SS' layout are parsed by slicing and cache lookups; anything
+    # the fast path does not recognise goes through the strptime parser,
+    # which raises the usual errors.
+    stripped = line.strip()
+    if not stripped or stripped[0] == '#':
+        return None
+
+    parts = stripped.split(',')
+    if len(parts) == 4:
+        caller_raw, callee_raw, timestamp_str, duration_str = parts
+        caller = _phone_cache.get(caller_raw) or _cached_phone(caller_raw)
+        callee = _phone_cache.get(callee_raw) or _cached_phone(callee_raw)
+        timestamp_str = timestamp_str.strip()
+        date_str = timestamp_str[:10]
+        clock_str = timestamp_str[10:]
+        day_start = _date_cache.get(date_str)
+        if day_start is None:
+            day_start = _cached_date(date_str)
+        clock = _clock_cache.get(clock_str)
+        if clock is None:
+            clock = _cached_clock(clock_str)
+        duration_str = duration_str.strip()
+        duration_secs = _duration_cache.get(duration_str)
+        if duration_secs is None:
+            duration_secs = _cached_duration(duration_str)
+        if caller and callee and day_start is not None and clock is not None and duration_secs is not None:
+            return caller, callee, day_start + clock, duration_secs
+
+    caller, callee, timestamp, duration_secs = _parse_call_line_strptime(line)
+    return caller, callee, to_epoch(timestamp), duration_secs
+
+
+def parse_call_line(line):
+
+    result = parse_call_record(line)
+    if result is None:
+        return None
+    caller, callee, start, duration_secs = result
+    return caller, callee, from_epoch(start), duration_secs
+
+
+@metrics.timed('parse.batch')
+def parse_call_lines(lines, first_line=1, line_nums=None):
+    # Bulk variant of parse_call_record. Returns the parsed records and a
+    # list of (line_num, exception) for lines that failed to parse. If
+    # line_nums is a list, each record's line number is appended to it.
+    records = []
+    errors = []
+    append = records.append
+    for line_num, line in enumerate(lines, start=first_line):
+        try:
+            result = parse_call_record(line)
+        except (PhoneNormalizationError, ValueError) as e:
+            errors.append((line_num, e))
+            continue
+        if result is not None:
+            append(result)
+            if line_nums is not None:
+                line_nums.append(line_num)
+    metrics.count('parse.lines', len(records) + len(errors))
+    metrics.count('parse.errors', len(errors))
+    return records, errors
+
+
+def call_parse_warning(line_num, e):
+    if isinstance(e, PhoneNormalizationError):
+        return f"Warning: Skipping calls.txt line {line_num} due to phone normalization error: {e}"
+    return f"Warning: Skipping calls.txt line {line_num} due to parse error: {e}"
+
+
 def parse_blocked_line(line):
 
     line = line.strip()
@@ -106,6 +264,7 @@ def parse_blocked_line(line):
 
 def load_phones(filepath):
     data.phonebook = {}
+    data.reset_tries()
     with open(filepath, 'r', encoding='utf-8') as f:
         for line_num, line in enumerate(f, start=1):
             try:
@@ -126,27 +285,138 @@ def load_phones(filepath):
             except ValueError as e:
                 # Skip invalid lines
                 print(f"Warning: Skipping invalid phones.txt line {line_num}: {e}")
-
-
-def load_calls(filepath):
-    data.calls = []
-    from popularity_graph import update_on_call
+    data.phone_edit_index = EditDistanceIndex(data.phonebook)
+    data.firstname_ngrams = TrigramIndex(data.firstname_trie.keys())
+    data.lastname_ngrams = TrigramIndex(data.lastname_trie.keys())
+
+
+def split_byte_ranges(filepath, parts):
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, bounds[-1]))
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _parse_call_chunk(task):
+    # Runs in a worker process: parses one byte range of calls.txt into
+    # local columns (numbers interned per chunk) plus a popularity partial.
+    from popularity_graph import new_partial, update_partial
+    filepath, start, end = task
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+
+    lines = list(io.StringIO(text, newline=None))
+    records, errors = parse_call_lines(lines)
+
+    numbers = {}
+    callers = array('i')
+    callees = array('i')
+    starts = array('q')
+    durations = array('q')
+    partial = new_partial()
+    for caller, callee, start, duration_secs in records:
+        callers.append(numbers.setdefault(caller, len(numbers)))
+        callees.append(numbers.setdefault(callee, len(numbers)))
+        starts.append(start)
+        durations.append(duration_secs)
+        update_partial(partial, caller, callee, duration_secs)
+
+    return len(lines), list(numbers), callers, callees, starts, durations, errors, partial
+
+
+def _load_calls_parallel(filepath, workers):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from popularity_graph import merge_partial
+    store = CallStore()
+    data.calls = SegmentedTimeline(store)
+    tasks = [(filepath, start, end) for start, end in split_byte_ranges(filepath, workers * CHUNKS_PER_WORKER)]
+    line_offset = 0
+    # Not fork: this runs on the background loader thread while the menu and
+    # call log threads are up, and a forked child could inherit one of
+    # their locks held.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver')) as pool:
+        for line_count, numbers, callers, callees, starts, durations, errors, partial in pool.map(_parse_call_chunk, tasks):
+            for line_num, e in errors:
+                print(call_parse_warning(line_offset + line_num, e))
+            line_offset += line_count
+
+            ids = [store.intern(number) for number in numbers]
+            first_row = len(store)
+            store.callers.extend(array('i', [ids[i] for i in callers]))
+            store.callees.extend(array('i', [ids[i] for i in callees]))
+            store.starts.extend(starts)
+            store.durations.extend(durations)
+            data.calls.rows.extend(range(first_row, len(store)))
+            merge_partial(partial)
+
+
+def load_calls(filepath, workers=1):
+    if workers and workers > 1 and os.path.getsize(filepath) >= PARALLEL_MIN_BYTES:
+        _load_calls_parallel(filepath, workers)
+        return
+
+    store = CallStore()
+    data.calls = SegmentedTimeline(store)
+    from popularity_graph import record_call
     with open(filepath, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, start=1):
-            try:
-                result = parse_call_line(line)
-                if result is None:
-                    continue  # Skip
-                caller, callee, timestamp, duration_secs = result
-                call = Call(caller, callee, timestamp, duration_secs)
-                data.calls.append(call)
-                update_on_call(call)
-            except PhoneNormalizationError as e:
-                print(f"Warning: Skipping calls.txt line {line_num} due to phone normalization error: {e}")
-                continue
-            except ValueError as e:
-                print(f"Warning: Skipping calls.txt line {line_num} due to parse error: {e}")
-                continue
+        line_num = 1
+        while True:
+            lines = list(islice(f, CALL_BLOCK_LINES))
+            if not lines:
+                break
+            records, errors = parse_call_lines(lines, first_line=line_num)
+            line_num += len(lines)
+            for e_line_num, e in errors:
+                print(call_parse_warning(e_line_num, e))
+            rows = data.calls.rows
+            for caller, callee, start, duration_secs in records:
+                rows.append(store.add(caller, callee, start, duration_secs))
+                record_call(caller, callee, duration_secs)
+
+
+def count_lines(filepath, end):
+    count = 0
+    with open(filepath, 'rb') as f:
+        remaining = end
+        while remaining > 0:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            count += block.count(b'\n')
+            remaining -= len(block)
+    return count
+
+
+def load_calls_tail(filepath, offset):
+    # Parses the part of calls.txt after `offset` (the size recorded in a
+    # snapshot) and merges those calls into the already loaded data.
+    from popularity_graph import record_call
+    from index import add_row_sorted
+    first_line = count_lines(filepath, offset) + 1
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        text = f.read().decode('utf-8')
+    lines = list(io.StringIO(text, newline=None))
+    records, errors = parse_call_lines(lines, first_line=first_line)
+    for line_num, e in errors:
+        print(call_parse_warning(line_num, e))
+    with data.lock:
+        store = data.calls.store
+        for caller, callee, start, duration_secs in records:
+            add_row_sorted(store.add(caller, callee, start, duration_secs), data.calls, data.call_index)
+            record_call(caller, callee, duration_secs)
+    return len(records)
 
 
 def load_blocked(filepath):
@@ -162,40 +432,100 @@ def load_blocked(filepath):
                 raise ValueError(f"Error parsing blocked.txt at line {line_num}: {e}")
 
 
-def load_all_data(phones_path, calls_path, blocked_path):
+def load_static_data(phones_path, blocked_path):
+    data.static_token = None
     print("Loading phone book...")
     load_phones(phones_path)
     print(f"  Loaded {len(data.phonebook)} contacts")
-    print("Loading call history...")
-    load_calls(calls_path)
-    print(f"  Loaded {len(data.calls)} calls")
     print("Loading blocked numbers...")
     load_blocked(blocked_path)
     print(f"  Loaded {len(data.blocked)} blocked numbers")
-    data.calls.sort(key=lambda c: c.start)
-    print(f"  Popularity graph has {len(data.popularity_graph.nodes)} nodes (built during load)")
+
+
+def load_call_data(calls_path, workers=1):
+    # Calls, the popularity graph and the call index, from scratch.
+    data.call_index = None
+    data.popularity_graph = None
+    print("Loading call history...")
+    load_calls(calls_path, workers=workers)
+    print(f"  Loaded {len(data.calls)} calls")
+    data.calls.sort()
+    print(f"  Popularity graph has {len(data.popularity_graph or ())} nodes (built during load)")
     print("Building call index...")
     from index import build_call_index
     data.call_index = build_call_index(data.calls)
     print(f"  Indexed {len(data.call_index)} phone numbers with call history")
 
 
+def load_all_data(phones_path, calls_path, blocked_path, workers=1):
+    load_static_data(phones_path, blocked_path)
+    load_call_data(calls_path, workers=workers)
+
+
+def format_call_line(call):
+    return format_call_record(call.caller, call.callee, call.start, call.duration)
+
+
+def format_call_record(caller, callee, start, duration):
+    timestamp_str = start.strftime("%d.%m.%Y %H:%M:%S")
+
+    hours = duration // 3600
+    minutes = (duration % 3600) // 60
+    seconds = duration % 60
+    duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+    return f"{caller}, {callee}, {timestamp_str}, {duration_str}\n"
+
+
+def _day_text(day):
+    text = _day_text_cache.get(day)
+    if text is None:
+        text = _remember(_day_text_cache, day, from_epoch(day * 86400).strftime("%d.%m.%Y"))
+    return text
+
+
+def format_epoch_record(caller, callee, start, duration):
+    # format_call_record for an epoch start, without a datetime per call.
+    day, clock = divmod(start, 86400)
+    hours, rest = divmod(clock, 3600)
+    minutes, seconds = divmod(rest, 60)
+    d_hours, d_rest = divmod(duration, 3600)
+    d_minutes, d_seconds = divmod(d_rest, 60)
+    return f"{caller}, {callee}, {_day_text(day)} {hours:02d}:{minutes:02d}:{seconds:02d}, {d_hours:02d}:{d_minutes:02d}:{d_seconds:02d}\n"
+
+
+def get_call_log():
+    global _call_log
+    if _call_log is None or _call_log.path != CALLS_FILE_PATH:
+        if _call_log is not None:
+            _call_log.close()
+        _call_log = open_call_log(CALLS_FILE_PATH, mode=CALL_LOG_MODE, interval_ms=CALL_LOG_INTERVAL_MS)
+    return _call_log
+
+
+def flush_call_log():
+    if _call_log is not None:
+        _call_log.flush()
+
+
+@metrics.timed('append.call')
 def append_call_to_file(call):
     try:
+        get_call_log().append(format_call_line(call))
+    except Exception as e:
+        print(f"Warning: Failed to append call to file (kept for the next flush): {e}")
 
-        timestamp_str = call.start.strftime("%d.%m.%Y %H:%M:%S")
-        
-        hours = call.duration // 3600
-        minutes = (call.duration % 3600) // 60
-        seconds = call.duration % 60
-        duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        
-        line = f"{call.caller}, {call.callee}, {timestamp_str}, {duration_str}\n"
-        
-        with open(CALLS_FILE_PATH, 'a', encoding='utf-8') as f:
-            f.write(line)
+
+@metrics.timed('append.batch')
+def append_records_to_file(records):
+    # records: (caller, callee, start epoch, duration); written as one batch.
+    try:
+        log = get_call_log()
+        metrics.count('append.rows', len(records))
+        log.extend([format_epoch_record(caller, callee, start, int(duration)) for caller, callee, start, duration in records])
+        log.flush()
     except Exception as e:
-        print(f"Warning: Failed to append call to file: {e}")
+        print(f"Warning: Failed to append {len(records)} calls to file (kept for the next flush): {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+from bisect import bisect_left
+
+
+class EditDistanceIndex:
+    # Answers "words within k edits (Levenshtein)" over a fixed word list.
+    # The words are kept sorted, which makes them an implicit trie: a prefix
+    # is a contiguous range found by bisect. search() walks that trie
+    # depth-first carrying one row of the edit-distance table per prefix,
+    # and drops a prefix as soon as every cell in its row exceeds k, so
+    # only the neighbourhood of the query is visited. Rows are computed
+    # only inside the diagonal band |i - j| <= k.
+
+    def __init__(self, words=()):
+        self.words = sorted(set(words))
+
+    def __len__(self):
+        return len(self.words)
+
+    def search(self, query, max_distance):
+        # (distance, word) for every word within max_distance edits, nearest
+        # first.
+        words = self.words
+        if not words:
+            return []
+        k = max_distance
+        m = len(query)
+        cap = k + 1
+        found = []
+        stack = [(0, len(words), 0, [j if j <= k else cap for j in range(m + 1)])]
+        while stack:
+            lo, hi, depth, row = stack.pop()
+            if len(words[lo]) == depth:
+                # Sorted order puts the word equal to the prefix first.
+                if row[m] <= k:
+                    found.append((row[m], words[lo]))
+                lo += 1
+            depth1 = depth + 1
+            if depth1 - k > m:
+                continue
+            j_lo = depth1 - k if depth1 > k else 1
+            j_hi = depth1 + k if depth1 + k < m else m
+            while lo < hi:
+                word = words[lo]
+                ch = word[depth]
+                end = bisect_left(words, word[:depth] + chr(ord(ch) + 1), lo, hi)
+                new = [cap] * (m + 1)
+                best = new[0] = depth1 if depth1 <= k else cap
+                left = new[j_lo - 1]
+                for j in range(j_lo, j_hi + 1):
+                    v = row[j - 1] + (query[j - 1] != ch)
+                    if left + 1 < v:
+                        v = left + 1
+                    if row[j] + 1 < v:
+                        v = row[j] + 1
+                    if v > cap:
+                        v = cap
+                    new[j] = left = v
+                    if v < best:
+                        best = v
+                if best <= k:
+                    stack.append((lo, end, depth1, new))
+                lo = end
+        found.sort()
+        return found
@@ -1,41 +1,52 @@
+from datetime import datetime, timedelta
+
 import data
-from index import get_calls_for_number
+import metrics
+from call_store import to_epoch, to_epoch_ceil
+from index import get_calls_between, get_usage_summary
 from data_load import normalize_phone
 
 
-def _in_range(call, start_dt, end_dt):
-    if start_dt and call.start < start_dt:
-        return False
-    if end_dt and call.start > end_dt:
-        return False
-    return True
-
-
+@metrics.timed('history.for')
 def get_history_for(number, start_dt = None, end_dt = None):
 
     num = normalize_phone(number)
-    calls = get_calls_for_number(data.call_index, num)
+    calls = data.call_index.get(num)
+    if calls is None:
+        return []
+    left = calls.bisect_left(to_epoch_ceil(start_dt)) if start_dt else 0
+    right = calls.bisect_right(to_epoch(end_dt)) if end_dt else len(calls)
     result = []
-    for c in calls:
-        if not _in_range(c, start_dt, end_dt):
-            continue
+    for c in calls[left:right]:
         direction = 'OUT' if c.caller == num else 'IN'
         result.append((c, direction))
     return result
 
 
+@metrics.timed('history.between')
 def get_history_between(a, b, start_dt = None, end_dt = None):
 
     a_num = normalize_phone(a)
     b_num = normalize_phone(b)
-    calls_a = get_calls_for_number(data.call_index, a_num)
-    result = []
-    for c in calls_a:
-        if not _in_range(c, start_dt, end_dt):
-            continue
-        if (c.caller == a_num and c.callee == b_num) or (c.caller == b_num and c.callee == a_num):
-            result.append(c)
-    return result
+    return get_calls_between(data.call_index, a_num, b_num, start_dt, end_dt)
+
+
+@metrics.timed('history.usage')
+def get_usage_for(number, start_dt = None, end_dt = None):
+
+    num = normalize_phone(number)
+    return get_usage_summary(data.call_index, num, start_dt, end_dt)
+
+
+def _parse_date(text, end_of_day = False):
+    # Accepts "dd.mm.yyyy" or "dd.mm.yyyy HH:MM:SS"; empty means open-ended.
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, "%d.%m.%Y %H:%M:%S")
+    except ValueError:
+        day = datetime.strptime(text, "%d.%m.%Y")
+        return day + timedelta(days=1, seconds=-1) if end_of_day else day
 
 
 def format_call(call, focus_number = None):
@@ -75,3 +86,21 @@ def prompt_and_show_history_between():
             print("  (no calls found)")
     except KeyboardInterrupt:
         print("\nCancelled.")
+
+
+def prompt_and_show_usage_summary():
+
+    try:
+        number = input("Enter number: ").strip()
+        start_dt = _parse_date(input("From (dd.mm.yyyy, empty for all): ").strip())
+        end_dt = _parse_date(input("To (dd.mm.yyyy, empty for all): ").strip(), end_of_day=True)
+        usage = get_usage_for(number, start_dt, end_dt)
+        print("\nUsage:")
+        print(f"  Outgoing: {usage['out_count']} calls, {usage['out_duration'] / 60:.1f} min")
+        print(f"  Incoming: {usage['in_count']} calls, {usage['in_duration'] / 60:.1f} min")
+        total = usage['out_duration'] + usage['in_duration']
+        print(f"  Total:    {usage['out_count'] + usage['in_count']} calls, {total / 60:.1f} min")
+    except ValueError as e:
+        print(f"Invalid input: {e}")
+    except KeyboardInterrupt:
+        print("\nCancelled.")
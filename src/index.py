@@ -1,14 +1,420 @@
-from bisect import bisect_left, bisect_right, insort_right
+from array import array
+from bisect import bisect_left, bisect_right
+
+from call_store import CallTimeline, SegmentedTimeline, to_epoch, to_epoch_ceil
+import metrics
+from segmented_rows import SegmentedRows
+
+# A per-number list moves into a SegmentedRows of this segment size once it
+# holds more than two segments' worth of rows; shorter lists are cheaper to
+# shift whole.
+NUMBER_SEGMENT_SIZE = 256
+
+
+class CallIndex:
+    # Per-number call lists over a shared CallStore. Each number keeps an
+    # array of row ids sorted by start time, or a SegmentedRows once the
+    # list is long; get() wraps it in a timeline. The store is not pickled
+    # with the index and must be re-attached.
+    #
+    # An index opened from a snapshot keeps its lists in one CSR table
+    # (offsets + rows); until a number is first read, its entry is just its
+    # slot in that table.
+    #
+    # Calls are also indexed per unordered pair of numbers, keyed by
+    # pair_key() of their interned ids, with a running total of the pair's
+    # call duration. Pairs live in a CSR base that is never written to
+    # (keys sorted for bisect, offsets, rows, durations), under layers of
+    # pairs changed since: writes copy a pair's list into the live overlay
+    # (_pairs), and capture_pairs() freezes that overlay as a layer so
+    # merge_pair_csr() can fold everything into a new base without the
+    # caller's lock.
+    #
+    # For range aggregates a number's list keeps running totals of OUT
+    # count, OUT duration and IN duration (IN count follows from the
+    # position) per segment, in its SegmentedRows. The first usage() query
+    # for a number moves its list into one and builds them; later writes
+    # patch them.
+
+    def __init__(self, store):
+        self.store = store
+        self._rows = {}
+        self._csr_offsets = None
+        self._csr_rows = None
+        self._pairs = None
+        self._pair_durations = None
+        self._pair_csr = None
+        self._pair_layers = []
+
+    @classmethod
+    def from_csr(cls, store, numbers, offsets, rows):
+        index = cls(store)
+        index._rows = dict(zip(numbers, range(len(numbers))))
+        index._csr_offsets = offsets
+        index._csr_rows = rows
+        return index
+
+    def set_pair_csr(self, keys, offsets, rows, durations):
+        # keys must be sorted, as merge_pair_csr() writes them.
+        self._pairs = {}
+        self._pair_durations = {}
+        self._pair_csr = (keys, offsets, rows, durations)
+        self._pair_layers = []
+
+    def __getstate__(self):
+        state = {'_rows': {number: array('I', self._lookup(number)) for number in self._rows}}
+        if self._pairs is not None:
+            keys, offsets, rows, durations = merge_pair_csr(self._pair_csr, self._pair_layers + [(self._pairs, self._pair_durations)])
+            state['_pairs'] = {key: rows[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+            state['_pair_durations'] = dict(zip(keys, durations))
+        return state
+
+    def __setstate__(self, state):
+        self.store = None
+        self._rows = state['_rows']
+        self._csr_offsets = None
+        self._csr_rows = None
+        # Pickles written before the pair index existed have no pairs;
+        # has_pairs() is False until build_pairs() is run.
+        self._pairs = state.get('_pairs')
+        self._pair_durations = state.get('_pair_durations')
+        self._pair_csr = None
+        self._pair_layers = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, number):
+        return number in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __getitem__(self, number):
+        if number not in self._rows:
+            raise KeyError(number)
+        return self._timeline(self._lookup(number))
+
+    def _lookup(self, number):
+        rows = self._rows.get(number)
+        if type(rows) is int:
+            offsets = self._csr_offsets
+            rows = self._rows[number] = self._csr_rows[offsets[rows]:offsets[rows + 1]]
+        return rows
+
+    def get(self, number, default=None):
+        rows = self._lookup(number)
+        if rows is None:
+            return default
+        return self._timeline(rows)
+
+    def _timeline(self, rows):
+        if type(rows) is SegmentedRows:
+            return SegmentedTimeline(self.store, rows)
+        return CallTimeline(self.store, rows)
+
+    def _writable(self, number):
+        # number's list (which must exist), as an array or SegmentedRows
+        # that can be written to in place.
+        rows = self._lookup(number)
+        if type(rows) is SegmentedRows:
+            return rows
+        if len(rows) > 2 * NUMBER_SEGMENT_SIZE:
+            rows = SegmentedRows(rows, self.store.starts.__getitem__, NUMBER_SEGMENT_SIZE)
+        elif type(rows) is not array:
+            rows = array('I', rows)
+        self._rows[number] = rows
+        return rows
+
+    def keys(self):
+        return self._rows.keys()
+
+    def has_pairs(self):
+        return self._pairs is not None
+
+    def build_pairs(self, timeline_rows):
+        # timeline_rows must be in start order so each pair list comes out
+        # sorted.
+        store = self.store
+        callers = store.callers
+        callees = store.callees
+        durations = store.durations
+        pairs = {}
+        pair_durations = {}
+        for row in timeline_rows:
+            key = pair_key(callers[row], callees[row])
+            rows = pairs.get(key)
+            if rows is None:
+                rows = pairs[key] = array('I')
+                pair_durations[key] = 0
+            rows.append(row)
+            pair_durations[key] += durations[row]
+        self._pairs = pairs
+        self._pair_durations = pair_durations
+        self._pair_csr = None
+        self._pair_layers = []
+
+    def _pair_find(self, key):
+        # (rows, total duration) of a pair, newest layer first, or None.
+        rows = self._pairs.get(key)
+        if rows is not None:
+            return rows, self._pair_durations[key]
+        for layer_rows, layer_durations in reversed(self._pair_layers):
+            rows = layer_rows.get(key)
+            if rows is not None:
+                return rows, layer_durations[key]
+        if self._pair_csr is not None:
+            keys, offsets, rows, durations = self._pair_csr
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return rows[offsets[i]:offsets[i + 1]], durations[i]
+        return None
+
+    def _pair_lookup(self, key):
+        found = self._pair_find(key)
+        return None if found is None else found[0]
+
+    def _pair_writable(self, key):
+        # The pair's list in the live overlay, copied there on first write
+        # (empty for a new pair); its duration total goes along with it.
+        rows = self._pairs.get(key)
+        if rows is None:
+            found = self._pair_find(key)
+            rows = self._pairs[key] = array('I', found[0]) if found else array('I')
+            self._pair_durations[key] = found[1] if found else 0
+        return rows
+
+    def capture_pairs(self):
+        # The pair index as of now, for merge_pair_csr(); nothing it refers
+        # to changes afterwards. Must be called under the same lock as the
+        # writes.
+        if self._pairs:
+            self._pair_layers.append((self._pairs, self._pair_durations))
+            self._pairs = {}
+            self._pair_durations = {}
+        return self._pair_csr, tuple(self._pair_layers)
+
+    def adopt_pair_csr(self, captured, merged):
+        # Makes merged (merge_pair_csr(*captured)) the new base, unless the
+        # pairs were replaced since the capture.
+        csr, layers = captured
+        current = self._pair_layers
+        if self._pair_csr is not csr or len(current) < len(layers) or any(a is not b for a, b in zip(current, layers)):
+            return
+        self._pair_csr = merged
+        del current[:len(layers)]
+
+    def _number_pair_key(self, a, b):
+        number_ids = self.store.number_ids
+        a_id = number_ids.get(a)
+        b_id = number_ids.get(b)
+        if a_id is None or b_id is None:
+            return None
+        return pair_key(a_id, b_id)
+
+    def pair(self, a, b):
+        # Calls between a and b in either direction, as a timeline, or None.
+        key = self._number_pair_key(a, b)
+        rows = None if key is None else self._pair_lookup(key)
+        if rows is None:
+            return None
+        return CallTimeline(self.store, rows)
+
+    def pair_stats(self, a, b):
+        # (number of calls, total duration in seconds) between a and b.
+        key = self._number_pair_key(a, b)
+        found = None if key is None else self._pair_find(key)
+        if found is None:
+            return 0, 0
+        rows, duration = found
+        return len(rows), duration
+
+    def _weigh(self, number):
+        # Usage weights of a row in number's list: (OUT count, OUT duration,
+        # IN duration).
+        store = self.store
+        number_id = store.number_ids[number]
+        callers = store.callers
+        durations = store.durations
+
+        def weigh(row):
+            if callers[row] == number_id:
+                return 1, durations[row], 0
+            return 0, 0, durations[row]
+        return weigh
+
+    def usage(self, number, start=None, end=None):
+        # Call counts and total seconds for number with start <= call start
+        # <= end (epoch seconds; None leaves that side open).
+        rows = self._lookup(number)
+        if rows is None:
+            return {'in_count': 0, 'out_count': 0, 'in_duration': 0, 'out_duration': 0}
+        if type(rows) is not SegmentedRows:
+            rows = self._rows[number] = SegmentedRows(rows, self.store.starts.__getitem__, NUMBER_SEGMENT_SIZE)
+        calls = SegmentedTimeline(self.store, rows)
+        left = 0 if start is None else calls.bisect_left(start)
+        right = len(rows) if end is None else calls.bisect_right(end)
+        if right < left:
+            right = left
+        weigh = self._weigh(number)
+        out_count, out_duration, in_duration = (b - a for a, b in zip(rows.totals(left, weigh, 3), rows.totals(right, weigh, 3)))
+        return {
+            'in_count': (right - left) - out_count,
+            'out_count': out_count,
+            'in_duration': in_duration,
+            'out_duration': out_duration,
+        }
+
+    def add_row(self, row):
+        store = self.store
+        numbers = store.numbers
+        caller_id = store.callers[row]
+        callee_id = store.callees[row]
+        for number_id in (caller_id, callee_id):
+            number = numbers[number_id]
+            if number not in self._rows:
+                self._rows[number] = array('I')
+            rows = self._writable(number)
+            if type(rows) is SegmentedRows:
+                rows.insert(row, store.starts.__getitem__, self._weigh(number))
+            else:
+                CallTimeline(store, rows).add_row(row)
+
+        if self._pairs is not None:
+            key = pair_key(caller_id, callee_id)
+            rows = self._pair_writable(key)
+            CallTimeline(store, rows).add_row(row)
+            self._pair_durations[key] += store.durations[row]
+
+    def to_csr(self):
+        offsets = array('q', [0])
+        rows = array('I')
+        for number in self._rows:
+            rows.extend(self._lookup(number))
+            offsets.append(len(rows))
+        return list(self._rows), offsets, rows
+
+    def add_rows(self, new_rows):
+        # Bulk add_row for rows sorted by start: each touched list gets one
+        # merge instead of an insort per row.
+        store = self.store
+        numbers = store.numbers
+        callers = store.callers
+        callees = store.callees
+        by_number = {}
+        for row in new_rows:
+            for number_id in (callers[row], callees[row]):
+                batch = by_number.get(number_id)
+                if batch is None:
+                    batch = by_number[number_id] = array('I')
+                batch.append(row)
+        starts = store.starts
+        entries = self._rows
+        for number_id, batch in by_number.items():
+            number = numbers[number_id]
+            rows = entries.get(number)
+            if rows is None:
+                entries[number] = batch
+                continue
+            rows = self._writable(number)
+            if type(rows) is SegmentedRows:
+                rows.merge(batch, starts.__getitem__, self._weigh(number))
+            else:
+                CallTimeline(store, rows).merge_rows(batch)
+
+        if self._pairs is not None:
+            durations = store.durations
+            pair_durations = self._pair_durations
+            by_pair = {}
+            for row in new_rows:
+                key = pair_key(callers[row], callees[row])
+                batch = by_pair.get(key)
+                if batch is None:
+                    batch = by_pair[key] = array('I')
+                batch.append(row)
+            key_start = starts.__getitem__
+            for key, batch in by_pair.items():
+                rows = self._pair_writable(key)
+                pair_durations[key] += sum(durations[row] for row in batch)
+                if len(batch) == 1:
+                    # Most pairs get one call per batch; skip the merge.
+                    row = batch[0]
+                    if not rows or starts[row] >= starts[rows[-1]]:
+                        rows.append(row)
+                    else:
+                        rows.insert(bisect_right(rows, starts[row], key=key_start), row)
+                else:
+                    CallTimeline(store, rows).merge_rows(batch)
+
+
+def _raw(column):
+    # An array or snapshot memoryview slice as bytes, for array.frombytes().
+    return memoryview(column).cast('B')
+
+
+def merge_pair_csr(csr, layers):
+    # One CSR table (keys, offsets, rows, durations; keys sorted) of a pair
+    # base and the layers above it, oldest first. Untouched runs of the base
+    # are copied as whole slices.
+    changed_rows = {}
+    changed_durations = {}
+    for layer_rows, layer_durations in layers:
+        changed_rows.update(layer_rows)
+        changed_durations.update(layer_durations)
+    if csr is None:
+        csr = (array('q'), array('q', [0]), array('I'), array('q'))
+    keys, offsets, rows, durations = csr
+    new_keys = array('q')
+    new_offsets = array('q', [0])
+    new_rows = array('I')
+    new_durations = array('q')
+
+    def copy_base(lo, hi):
+        if lo >= hi:
+            return
+        new_keys.frombytes(_raw(keys[lo:hi]))
+        new_durations.frombytes(_raw(durations[lo:hi]))
+        shift = len(new_rows) - offsets[lo]
+        new_rows.frombytes(_raw(rows[offsets[lo]:offsets[hi]]))
+        if shift:
+            new_offsets.extend([offset + shift for offset in offsets[lo + 1:hi + 1]])
+        else:
+            new_offsets.frombytes(_raw(offsets[lo + 1:hi + 1]))
+
+    pos = 0
+    for key in sorted(changed_rows):
+        i = bisect_left(keys, key, pos)
+        copy_base(pos, i)
+        new_keys.append(key)
+        new_rows.extend(changed_rows[key])
+        new_offsets.append(len(new_rows))
+        new_durations.append(changed_durations[key])
+        pos = i + 1 if i < len(keys) and keys[i] == key else i
+    copy_base(pos, len(keys))
+    return new_keys, new_offsets, new_rows, new_durations
+
+
+def pair_key(a_id, b_id):
+    # Unordered: pair_key(a, b) == pair_key(b, a).
+    return (a_id << 32) | b_id if a_id <= b_id else (b_id << 32) | a_id
 
 
 def build_call_index(calls):
 
-    index = {}
-    for call in calls:
-        for number in [call.caller, call.callee]:
-            if number not in index:
-                index[number] = []
-            index[number].append(call)
+    store = calls.store
+    index = CallIndex(store)
+    lists = index._rows
+    numbers = store.numbers
+    callers = store.callers
+    callees = store.callees
+    for row in calls.rows:
+        for number_id in (callers[row], callees[row]):
+            number = numbers[number_id]
+            rows = lists.get(number)
+            if rows is None:
+                rows = lists[number] = array('I')
+            rows.append(row)
+    index.build_pairs(calls.rows)
 
     return index
 
@@ -20,23 +426,57 @@ def get_calls_for_number(index, number):
 
 def get_calls_in_time_range(index, number, start_dt, end_dt):
 
-    calls = index.get(number, [])
+    calls = index.get(number)
+    if calls is None:
+        return []
 
-    left = bisect_left(calls, start_dt, key=lambda c: c.start)
-    right = bisect_right(calls, end_dt, key=lambda c: c.start)
+    left = calls.bisect_left(to_epoch_ceil(start_dt))
+    right = calls.bisect_right(to_epoch(end_dt))
     return calls[left:right]
 
 
+def get_calls_between(index, a, b, start_dt=None, end_dt=None):
+
+    calls = index.pair(a, b)
+    if calls is None:
+        return []
+
+    left = 0 if start_dt is None else calls.bisect_left(to_epoch_ceil(start_dt))
+    right = len(calls) if end_dt is None else calls.bisect_right(to_epoch(end_dt))
+    return calls[left:right]
+
+
+def get_pair_stats(index, a, b):
+
+    return index.pair_stats(a, b)
+
+
+def get_usage_summary(index, number, start_dt=None, end_dt=None):
+
+    start = None if start_dt is None else to_epoch_ceil(start_dt)
+    end = None if end_dt is None else to_epoch(end_dt)
+    return index.usage(number, start, end)
+
+
+@metrics.timed('insert.call')
 def add_call_sorted(call, calls, index) -> None:
 
-    if not calls or call.start >= calls[-1].start:
-        calls.append(call)
-    else:
-        insort_right(calls, call, key=lambda c: c.start)
+    add_row_sorted(calls.store.add_call(call), calls, index)
 
-    for number in (call.caller, call.callee):
-        lst = index.setdefault(number, [])
-        if not lst or call.start >= lst[-1].start:
-            lst.append(call)
-        else:
-            insort_right(lst, call, key=lambda c: c.start)
+
+def add_row_sorted(row, calls, index) -> None:
+
+    calls.add_row(row)
+    index.add_row(row)
+
+
+@metrics.timed('insert.batch')
+def add_records_sorted(records, calls, index):
+
+    # records: (caller, callee, start epoch, duration) sorted by start.
+    # Returns the new row ids.
+    rows = calls.store.add_many(records)
+    metrics.count('insert.rows', len(rows))
+    calls.merge_rows(rows)
+    index.add_rows(rows)
+    return rows
@@ -1,72 +1,187 @@
 from __future__ import annotations
+import heapq
+import threading
 import time
 from datetime import datetime
+from itertools import count
 
 from call import Call, _format_mmss
 import data
 from data_load import normalize_phone, append_call_to_file
 from index import add_call_sorted
 from popularity_graph import update_on_call
-from nonblocking_process import KeyboardThread
 
 
+class LiveCallManager:
+	# Open live calls are plain records keyed by call id; nothing runs per
+	# call. A number can only be on one open call at a time. Calls started
+	# with a max_duration are hung up by a single timer thread that sleeps
+	# until the earliest deadline. Ending a call commits it to the timeline,
+	# index, popularity graph and calls.txt.
+
+	def __init__(self):
+		self._cond = threading.Condition()
+		self._open = {}
+		self._engaged = {}
+		self._ids = count(1)
+		self._deadlines = []
+		self._timer = None
+
+	def __len__(self):
+		return len(self._open)
+
+	def start(self, caller, callee, max_duration=None):
+		# Returns the new call id, or None if the call cannot start.
+
+		caller_num = normalize_phone(caller)
+		callee_num = normalize_phone(callee)
+
+		#Blocked check
+		if caller_num in data.blocked or callee_num in data.blocked:
+			print(f"[BLOCKED] Cannot start call: {caller_num} → {callee_num} (blocked number)")
+			return None
+
+		with self._cond:
+			for number in (caller_num, callee_num):
+				if number in self._engaged:
+					print(f"[BUSY] {number} is already on call #{self._engaged[number]}")
+					return None
+			call_id = next(self._ids)
+			started = time.monotonic()
+			self._open[call_id] = (caller_num, callee_num, datetime.now().replace(microsecond=0), started)
+			self._engaged[caller_num] = call_id
+			self._engaged[callee_num] = call_id
+			if max_duration is not None:
+				heapq.heappush(self._deadlines, (started + max_duration, call_id))
+				self._ensure_timer()
+				self._cond.notify()
+		return call_id
+
+	def end(self, call_id):
+		# Returns the committed Call, or None if call_id is not open.
+
+		with self._cond:
+			entry = self._open.pop(call_id, None)
+			if entry is None:
+				return None
+			caller_num, callee_num, start_dt, started = entry
+			# A call to yourself holds one entry, not two.
+			self._engaged.pop(caller_num, None)
+			self._engaged.pop(callee_num, None)
+
+		call = Call(caller_num, callee_num, start_dt, max(1, int(time.monotonic() - started)))
+		# Update data structures
+		with data.lock:
+			add_call_sorted(call, data.calls, data.call_index)
+			update_on_call(call)
+			# Append to calls.txt
+			append_call_to_file(call)
+		return call
+
+	def end_all(self):
+		with self._cond:
+			call_ids = list(self._open)
+		return [call for call in map(self.end, call_ids) if call is not None]
+
+	def list(self):
+		# [(call id, caller, callee, start, elapsed seconds)] oldest first.
+		now = time.monotonic()
+		with self._cond:
+			return [(call_id, caller, callee, start_dt, int(now - started)) for call_id, (caller, callee, start_dt, started) in self._open.items()]
+
+	def _ensure_timer(self):
+		if self._timer is None:
+			self._timer = threading.Thread(target=self._run_timer, name='live-call-timer', daemon=True)
+			self._timer.start()
+
+	def _run_timer(self):
+		while True:
+			with self._cond:
+				while not self._deadlines:
+					self._cond.wait()
+				deadline, call_id = self._deadlines[0]
+				delay = deadline - time.monotonic()
+				if delay > 0:
+					# Woken early when a sooner deadline is added.
+					self._cond.wait(delay)
+					continue
+				heapq.heappop(self._deadlines)
+			# Calls already ended by hand are skipped by end(). A call that
+			# fails to commit must not stop the timer for all the others.
+			try:
+				self.end(call_id)
+			except Exception as e:
+				print(f"[ERROR] Automatic hang-up of call #{call_id} failed: {e}")
+
+
+live_calls = LiveCallManager()
+
+
+def prompt_and_start_call():
 
-def start_live_call(caller, callee):
-
-	caller_num = normalize_phone(caller)
-	callee_num = normalize_phone(callee)
-
-	#Blocked check
-	if caller_num in data.blocked or callee_num in data.blocked:
-		print(f"[BLOCKED] Cannot start call: {caller_num} → {callee_num} (blocked number)")
+	try:
+		caller = input("Enter caller number: ").strip()
+		callee = input("Enter callee number: ").strip()
+		limit = input("Hang up automatically after how many seconds (Enter for never): ").strip()
+		max_duration = int(limit) if limit else None
+		call_id = live_calls.start(caller, callee, max_duration)
+	except ValueError as e:
+		print(f"Invalid input: {e}")
 		return None
+	if call_id is not None:
+		print(f"Started live call #{call_id}.")
+	return call_id
 
-	start_dt = datetime.now()
-	start_ts = time.time()
-	print(f"Starting live call: {caller_num} → {callee_num}")
-	print("Press Enter to end the call…")
 
-	done = {"value": False}
+def prompt_and_end_call():
 
-	def on_key(_inp):
-		done["value"] = True
-
-	KeyboardThread(on_key)
-
-	last_shown = -1
+	open_calls = live_calls.list()
+	if not open_calls:
+		print("No open calls.")
+		return None
+	default = open_calls[0][0] if len(open_calls) == 1 else None
+	text = input(f"Call id to end{f' [{default}]' if default else ''}: ").strip()
 	try:
-		while not done["value"]:
-			elapsed = int(time.time() - start_ts)
-			if elapsed != last_shown:
-				print(f"Duration: {_format_mmss(elapsed)}", end="\r", flush=True)
-				last_shown = elapsed
-			time.sleep(0.2)
-	except KeyboardInterrupt:
-		print("\nCancelled by user.")
+		call_id = int(text) if text else default
+	except ValueError:
+		call_id = None
+	call = live_calls.end(call_id) if call_id is not None else None
+	if call is None:
+		print("No such open call.")
 		return None
+	print(f"[OK] {call}")
+	return call
 
-	duration_secs = max(1, int(time.time() - start_ts))
-	print("\nEnding call…")
 
-	call = Call(caller_num, callee_num, start_dt, duration_secs)
-	# Update data structures
-	add_call_sorted(call, data.calls, data.call_index)
-	update_on_call(call)
-	
-	# Append to calls.txt
-	append_call_to_file(call)
+def print_open_calls():
 
-	print(f"[OK] {call}")
-	return call
+	open_calls = live_calls.list()
+	if not open_calls:
+		print("No open calls.")
+		return
+	print(f"\nOpen calls ({len(open_calls)}):")
+	for call_id, caller, callee, start_dt, elapsed in open_calls:
+		print(f"  #{call_id}: {caller} → {callee} since {start_dt.strftime('%H:%M:%S')} ({_format_mmss(elapsed)})")
 
 
 def prompt_and_start_live_call():
 
+	actions = {
+		"s": prompt_and_start_call,
+		"e": prompt_and_end_call,
+		"l": print_open_calls,
+	}
 	try:
-		caller = input("Enter caller number: ").strip()
-		callee = input("Enter callee number: ").strip()
-		return start_live_call(caller, callee)
+		while True:
+			print(f"\nLive calls: {len(live_calls)} open")
+			print("s. Start a call   e. End a call   l. List open calls   Enter. Back")
+			choice = input("Select: ").strip().lower()
+			if not choice:
+				return
+			action = actions.get(choice)
+			if action is None:
+				print("Invalid option.")
+				continue
+			action()
 	except KeyboardInterrupt:
 		print("\nCancelled.")
-		return None
-
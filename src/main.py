@@ -1,22 +1,40 @@
+import os
 import sys
 import atexit
-from data_load import load_all_data
+from data_load import BLOCKED_FILE_PATH, CALLS_FILE_PATH, PHONES_FILE_PATH, load_call_data, load_static_data
 import data
 from call_from_file import call_from_file
 from history import (
     prompt_and_show_history_for,
     prompt_and_show_history_between,
+    prompt_and_show_usage_summary,
 )
-from live_call import prompt_and_start_live_call
+from live_call import live_calls, prompt_and_start_live_call
 from search import prompt_and_search
-from persistence import load_preprocessed, save_preprocessed, preprocessed_files_exist
-from simulator import run_overload_simulation
+from persistence import BackgroundSaver, load_preprocessed_static, save_preprocessed, preprocessed_files_exist
+from simulator import run_batched_simulation, run_overload_simulation
+from metrics import prompt_and_manage_metrics
+from startup import is_loading, load_calls_in_background, needs_calls, take_notice
+
+SNAPSHOT_INTERVAL_SECONDS = 300
 
 _save_done = False
+_saver = None
 
 def save_on_exit():
     global _save_done
-    if not _save_done and data.phonebook is not None:
+    if _saver is not None:
+        _saver.stop()
+    if is_loading() or data.calls_error is not None:
+        # A snapshot now would be missing the calls.
+        if not _save_done:
+            print("Call history was not loaded; snapshot not saved.")
+            _save_done = True
+        return
+    if data.calls is not None and len(live_calls):
+        # Hang up calls still open so they are kept in the snapshot.
+        live_calls.end_all()
+    if not _save_done and data.phonebook is not None and data.calls is not None:
         save_preprocessed()
         _save_done = True
 
@@ -32,12 +50,36 @@ def print_blocked():
         print(f"  {phone}")
 
 def simulate_calls_action():
+    show = input("Print every call? (y/N): ").strip().lower()
     print("\nSimulating calls from call_simulation.txt...")
-    call_from_file('../data/call_simulation.txt', data.blocked)
+    call_from_file('../data/call_simulation.txt', data.blocked, log="all" if show == "y" else "errors")
 
 def run_overload_action():
     run_overload_simulation(60)
 
+def run_batched_overload_action():
+    rate = input("Target calls per second (Enter for unlimited): ").strip()
+    try:
+        target_rate = int(rate) if rate else None
+    except ValueError:
+        print("Invalid rate.")
+        return
+    run_batched_simulation(60, target_rate=target_rate)
+
+def run_switchboard_action():
+    # asyncio is only imported when the switchboard is first used.
+    from switchboard import prompt_and_run_switchboard
+    prompt_and_run_switchboard()
+
+def save_snapshot_action():
+    if _saver is None:
+        save_preprocessed()
+        return
+    _saver.request()
+    print("Snapshot requested; it is being saved in the background.")
+    if _saver.last_error is not None:
+        print(f"Warning: last background snapshot failed: {_saver.last_error}")
+
 def exit_action():
     save_on_exit()
     print("Exiting.")
@@ -48,6 +90,7 @@ def main():
     
     atexit.register(save_on_exit)
     
+    load_calls = None
     if preprocessed_files_exist():
         print("1. Load preprocessed data (fast)")
         print("2. Rebuild from source files (slow)")
@@ -55,48 +98,53 @@ def main():
         while True:
             choice = input("\nSelect option (1-2): ").strip()
             if choice == "1":
-                if load_preprocessed():
-                    print("Data loaded successfully.")
+                load_calls = load_preprocessed_static()
+                if load_calls is not None:
                     break
                 else:
                     print("Failed to load preprocessed data. Rebuilding from source...")
                     choice = "2"
             
             if choice == "2":
-                try:
-                    load_all_data(
-                        '../data/phones.txt',
-                        '../data/calls.txt',
-                        '../data/blocked.txt'
-                    )
-                    print("Data loaded successfully.")
-                    break
-                except Exception as e:
-                    print(f"Error loading data: {e}")
-                    sys.exit(1)
+                break
             else:
                 print("Invalid choice. Please select 1 or 2.")
     else:
         print("\nNo preprocessed data found. Building from source files...")
+
+    if load_calls is None:
         try:
-            load_all_data(
-                '../data/phones.txt',
-                '../data/calls.txt',
-                '../data/blocked.txt'
-            )
-            print("Data loaded successfully.")
+            load_static_data(PHONES_FILE_PATH, BLOCKED_FILE_PATH)
         except Exception as e:
             print(f"Error loading data: {e}")
             sys.exit(1)
+
+    def rebuild_calls():
+        load_call_data(CALLS_FILE_PATH, workers=os.cpu_count())
+
+    def calls_loaded():
+        global _saver
+        _saver = BackgroundSaver(SNAPSHOT_INTERVAL_SECONDS).start()
+
+    # Contacts and blocked numbers are in; calls, the call index and the
+    # popularity graph load in the background while the menu is up.
+    load_calls_in_background(load_calls or rebuild_calls, rebuild_calls, calls_loaded)
+    print("Contacts loaded; call history is loading in the background.")
+
     menu = {
         "1": print_contacts,
         "2": print_blocked,
-        "3": simulate_calls_action,
-        "4": prompt_and_show_history_for,
-        "5": prompt_and_show_history_between,
-        "6": prompt_and_start_live_call,
+        "3": needs_calls(simulate_calls_action),
+        "4": needs_calls(prompt_and_show_history_for),
+        "5": needs_calls(prompt_and_show_history_between),
+        "6": needs_calls(prompt_and_start_live_call),
         "7": prompt_and_search,
-        "8": run_overload_action,
+        "8": needs_calls(run_overload_action),
+        "9": needs_calls(save_snapshot_action),
+        "10": needs_calls(prompt_and_show_usage_summary),
+        "11": needs_calls(run_batched_overload_action),
+        "12": needs_calls(run_switchboard_action),
+        "13": prompt_and_manage_metrics,
     }
     menu_text = [
         "1. Show contacts",
@@ -104,12 +152,20 @@ def main():
         "3. Simulate calls from file",
         "4. Show history for a number",
         "5. Show history between two numbers",
-        "6. Start a live call",
+        "6. Live calls (start / end / list)",
         "7. Search phone book",
         "8. Run overload simulation (1 min)",
+        "9. Save snapshot now (background)",
+        "10. Usage summary for a number",
+        "11. Run batched overload simulation (1 min)",
+        "12. Switchboard capacity simulation",
+        "13. Metrics (show / enable / dump)",
         "Press Enter to exit",
     ]
     while True:
+        notice = take_notice()
+        if notice is not None:
+            print(f"\n{notice}")
         print("\nMenu:")
         for line in menu_text:
             print(line)
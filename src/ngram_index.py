@@ -0,0 +1,56 @@
+import heapq
+from array import array
+from collections import Counter
+from itertools import chain
+
+# Names scoring below this Dice similarity are not returned.
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(text):
+    # Padded so that the start and end of a name count as context.
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    # Posting lists from each trigram to the ids of the names containing
+    # it. similar() counts shared trigrams with a Counter over the query's
+    # posting lists and ranks names by Dice coefficient, so it only touches
+    # names that share at least one trigram with the query.
+
+    def __init__(self, names=()):
+        self.names = []
+        self.sizes = array('H')
+        self.postings = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        name_id = len(self.names)
+        grams = trigrams(name)
+        self.names.append(name)
+        self.sizes.append(len(grams))
+        postings = self.postings
+        for gram in grams:
+            ids = postings.get(gram)
+            if ids is None:
+                ids = postings[gram] = array('I')
+            ids.append(name_id)
+
+    def similar(self, text, limit=20, min_similarity=MIN_SIMILARITY):
+        # [(similarity, name)] best first.
+        grams = trigrams(text)
+        postings = self.postings
+        shared = Counter(chain.from_iterable(postings[gram] for gram in grams if gram in postings))
+        if not shared:
+            return []
+        query_size = len(grams)
+        sizes = self.sizes
+        scored = ((2.0 * count / (query_size + sizes[name_id]), name_id) for name_id, count in shared.items())
+        best = heapq.nlargest(limit, scored)
+        names = self.names
+        return [(similarity, names[name_id]) for similarity, name_id in best if similarity >= min_similarity]
@@ -1,113 +1,574 @@
+from datetime import datetime
+import hashlib
+import json
 import os
 import pickle
+import threading
+from array import array
 import data
+from call_store import CallStore, SegmentedTimeline
+from edit_index import EditDistanceIndex
+from index import CallIndex, merge_pair_csr
+from ngram_index import TrigramIndex
+from popularity_graph import EDGE_COLUMNS, NODE_COLUMNS, PopularityGraph
+from radix_trie import RadixTrie
+from snapshot import Snapshot, SnapshotError, decode_strings, encode_strings, typecode, write_snapshot
 
 
 PREPROCESSED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'preprocessed')
 
+MANIFEST_FILE = 'manifest.json'
+# 2: pair keys in the call snapshot are sorted.
+MANIFEST_VERSION = 2
+
+# A snapshot is a set of files listed in manifest.json: call data
+# (calls, call index, popularity graph) in a binary calls.<gen>.snap, and
+# the phonebook, tries and blocked set pickled next to it. Files are
+# written under new names and the manifest is swapped in last, so a
+# crash mid-save leaves the previous snapshot intact.
+STATIC_PARTS = ['phonebook', 'tries', 'blocked']
+
+# The manifest also records the size and a fingerprint (hash of the size,
+# the first and the last FINGERPRINT_BYTES up to that size) of each source
+# file, so startup can tell an appended-to calls.txt from a rewritten one.
+FINGERPRINT_BYTES = 64 * 1024
+
+PICKLE_FILES = [
+    'phonebook.pickle',
+    'calls.pickle',
+    'call_index.pickle',
+    'tries.pickle',
+    'popularity_graph.pickle',
+    'blocked.pickle'
+]
+
+# The open snapshot backing data.calls / data.call_index; kept alive here
+# because the loaded columns are views into its mapping.
+_snapshot = None
+
+# Serialises snapshot writers (background thread and exit save).
+_save_lock = threading.Lock()
+
 
 def ensure_preprocessed_dir():
     os.makedirs(PREPROCESSED_DIR, exist_ok=True)
 
 
+def _path(name):
+    return os.path.join(PREPROCESSED_DIR, name)
+
+
+def _all_exist(files):
+    return all(os.path.exists(_path(f)) for f in files)
+
+
+def read_manifest():
+    try:
+        with open(_path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    if not _all_exist(manifest['files'].values()):
+        return None
+    return manifest
+
+
+def snapshot_exists():
+    return read_manifest() is not None
+
+
+def pickles_exist():
+    return _all_exist(PICKLE_FILES)
+
+
 def preprocessed_files_exist():
-    required_files = [
-        'phonebook.pickle',
-        'calls.pickle',
-        'call_index.pickle',
-        'tries.pickle',
-        'popularity_graph.pickle',
-        'blocked.pickle'
-    ]
-    return all(os.path.exists(os.path.join(PREPROCESSED_DIR, f)) for f in required_files)
+    return snapshot_exists() or pickles_exist()
 
 
-def save_preprocessed():
+def _source_paths():
+    from data_load import BLOCKED_FILE_PATH, CALLS_FILE_PATH, PHONES_FILE_PATH
+    return {'calls': CALLS_FILE_PATH, 'phones': PHONES_FILE_PATH, 'blocked': BLOCKED_FILE_PATH}
 
-    ensure_preprocessed_dir()
-    
-    print("Saving preprocessed data...")
-    
 
-    with open(os.path.join(PREPROCESSED_DIR, 'phonebook.pickle'), 'wb') as f:
-        pickle.dump(data.phonebook, f)
-    print("  Saved phonebook.pickle")
-    
+def file_fingerprint(path, size):
+    h = hashlib.sha1(str(size).encode('ascii'))
+    if size:
+        with open(path, 'rb') as f:
+            h.update(f.read(min(size, FINGERPRINT_BYTES)))
+            tail = max(0, size - FINGERPRINT_BYTES)
+            f.seek(tail)
+            h.update(f.read(size - tail))
+    return h.hexdigest()
+
+
+def source_state(path):
+    # A missing file is recorded as an empty one.
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    return {'size': size, 'fingerprint': file_fingerprint(path, size)}
+
+
+def compare_source(recorded, path):
+    # 'same', 'grown' (recorded content is an unchanged prefix) or 'changed'.
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    if size < recorded['size']:
+        return 'changed'
+    if file_fingerprint(path, recorded['size']) != recorded['fingerprint']:
+        return 'changed'
+    return 'same' if size == recorded['size'] else 'grown'
+
+
+def _fsync_dir():
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(PREPROCESSED_DIR, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _write_atomic(name, write):
+    tmp_path = _path(name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _path(name))
+
+
+def _dump_pickle(name, obj, quiet=False):
+    _write_atomic(name, lambda f: pickle.dump(obj, f))
+    if not quiet:
+        print(f"  Saved {name}")
+
 
-    with open(os.path.join(PREPROCESSED_DIR, 'calls.pickle'), 'wb') as f:
-        pickle.dump(data.calls, f)
-    print("  Saved calls.pickle")
+def _load_pickle(name):
+    with open(_path(name), 'rb') as f:
+        return pickle.load(f)
 
-    with open(os.path.join(PREPROCESSED_DIR, 'call_index.pickle'), 'wb') as f:
-        pickle.dump(data.call_index, f)
-    print("  Saved call_index.pickle")
 
-    tries = {
+def _tries():
+    return {
         'firstname': data.firstname_trie,
         'lastname': data.lastname_trie,
-        'phone': data.phone_trie
+        'phone': data.phone_trie,
+        'phone_edits': data.phone_edit_index,
+        'firstname_ngrams': data.firstname_ngrams,
+        'lastname_ngrams': data.lastname_ngrams,
     }
-    with open(os.path.join(PREPROCESSED_DIR, 'tries.pickle'), 'wb') as f:
-        pickle.dump(tries, f)
-    print("  Saved tries.pickle")
-    
-
-    with open(os.path.join(PREPROCESSED_DIR, 'popularity_graph.pickle'), 'wb') as f:
-        pickle.dump(data.popularity_graph, f)
-    print("  Saved popularity_graph.pickle")
-    
-    with open(os.path.join(PREPROCESSED_DIR, 'blocked.pickle'), 'wb') as f:
-        pickle.dump(data.blocked, f)
-    print("  Saved blocked.pickle")
-    
+
+
+def _radix(trie):
+    # Tries pickled before the switch to RadixTrie were pytrie StringTries
+    # of key -> list of contacts.
+    if isinstance(trie, RadixTrie):
+        return trie
+    radix = RadixTrie()
+    for key, contacts in trie.items():
+        for contact in contacts:
+            radix.add(key, contact)
+    return radix
+
+
+def _set_tries(tries):
+    data.firstname_trie = _radix(tries['firstname'])
+    data.lastname_trie = _radix(tries['lastname'])
+    data.phone_trie = _radix(tries['phone'])
+    # Pickles saved before the fuzzy-search indexes existed lack them.
+    data.phone_edit_index = tries.get('phone_edits')
+    if data.phone_edit_index is None:
+        data.phone_edit_index = EditDistanceIndex(data.phonebook)
+    data.firstname_ngrams = tries.get('firstname_ngrams')
+    if data.firstname_ngrams is None:
+        data.firstname_ngrams = TrigramIndex(data.firstname_trie.keys())
+    data.lastname_ngrams = tries.get('lastname_ngrams')
+    if data.lastname_ngrams is None:
+        data.lastname_ngrams = TrigramIndex(data.lastname_trie.keys())
+
+
+def _frozen(column):
+    # Copy arrays that may keep growing while a background save writes
+    # them out; snapshot-backed memoryviews are read-only and kept as is.
+    return column if type(column) is memoryview else column[:]
+
+
+def _snapshot_sections():
+    # Must be called with data.lock held; every section returned is a
+    # private copy, so it can be written out after the lock is released.
+    # The pair index is only captured here; _pair_sections() turns it into
+    # sections later, without the lock.
+    store = data.calls.store
+    sections = []
+
+    index_numbers, index_offsets, index_rows = data.call_index.to_csr()
+    index_ids = array('i', [store.intern(number) for number in index_numbers])
+    pairs = (data.call_index, data.call_index.capture_pairs())
+    graph = data.popularity_graph
+    graph_ids = array('i', [store.intern(number) for number in graph.numbers])
+
+    number_offsets, number_bytes = encode_strings(store.numbers)
+    sections.append(('numbers.offsets', 'q', number_offsets))
+    sections.append(('numbers.bytes', 'B', number_bytes))
+
+    sections.append(('calls.callers', 'i', _frozen(store.callers)))
+    sections.append(('calls.callees', 'i', _frozen(store.callees)))
+    sections.append(('calls.starts', 'q', _frozen(store.starts)))
+    # 'q' since durations went 64-bit; a store still backed by an older
+    # snapshot keeps that snapshot's 'i' column until it is first written.
+    sections.append(('calls.durations', typecode(store.durations), _frozen(store.durations)))
+    sections.append(('calls.timeline', 'I', _frozen(data.calls.rows)))
+
+    sections.append(('index.numbers', 'i', index_ids))
+    sections.append(('index.offsets', 'q', index_offsets))
+    sections.append(('index.rows', 'I', index_rows))
+
+    sections.append(('graph.nodes', 'i', graph_ids))
+    for name, column in graph.columns().items():
+        sections.append((f'graph.{name}', typecode(column), _frozen(column)))
+    return sections, pairs
+
+
+def _pair_sections(pairs):
+    # Merges the captured pair index into one CSR table and lets the index
+    # use it as its new base, so the layers do not pile up between saves.
+    call_index, captured = pairs
+    merged = merge_pair_csr(*captured)
+    with data.lock:
+        call_index.adopt_pair_csr(captured, merged)
+    keys, offsets, rows, durations = merged
+    return [
+        ('index.pair_keys', 'q', keys),
+        ('index.pair_offsets', 'q', offsets),
+        ('index.pair_rows', 'I', rows),
+        ('index.pair_durations', 'q', durations),
+    ]
+
+
+def capture_snapshot():
+    # The only part of a save that blocks callers adding calls: copies the
+    # call columns, index and graph counters under data.lock.
+    with data.lock:
+        sections, pairs = _snapshot_sections()
+        static = {'phonebook': data.phonebook, 'tries': _tries(), 'blocked': data.blocked}
+        if data.static_token is None:
+            data.static_token = os.urandom(16).hex()
+        token = data.static_token
+        # calls.txt is appended to under data.lock, so once the call log is
+        # flushed its size matches exactly the calls captured above.
+        from data_load import flush_call_log
+        flush_call_log()
+        sources = {name: source_state(path) for name, path in _source_paths().items()}
+    return sections, pairs, static, token, sources
+
+
+def write_snapshot_files(captured, quiet=False):
+    sections, pairs, static, token, sources = captured
+    sections = sections + _pair_sections(pairs)
+    with _save_lock:
+        ensure_preprocessed_dir()
+        previous = read_manifest()
+        generation = previous['generation'] + 1 if previous else 1
+        files = {}
+
+        for part in STATIC_PARTS:
+            if previous and previous.get('static_token') == token:
+                files[part] = previous['files'][part]
+            else:
+                files[part] = f'{part}.{generation}.pickle'
+                _dump_pickle(files[part], static[part], quiet=quiet)
+
+        files['calls'] = f'calls.{generation}.snap'
+        write_snapshot(_path(files['calls']), sections)
+        if not quiet:
+            print(f"  Saved {files['calls']}")
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'generation': generation,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'static_token': token,
+            'sources': sources,
+            'files': files,
+        }
+        _write_atomic(MANIFEST_FILE, lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+        _fsync_dir()
+
+        if previous:
+            for name in set(previous['files'].values()) - set(files.values()):
+                try:
+                    os.remove(_path(name))
+                except OSError:
+                    pass
+    return generation
+
+
+def save_preprocessed(fmt='snapshot'):
+
+    ensure_preprocessed_dir()
+
+    if fmt == 'pickle':
+        save_pickles()
+        return
+
+    print("Saving preprocessed data...")
+    write_snapshot_files(capture_snapshot())
     print("Preprocessed data saved successfully.")
 
 
-def load_preprocessed():
+class BackgroundSaver:
+    # Writes snapshots on a daemon thread, every `interval` seconds and/or
+    # whenever request() is called. Only capture_snapshot() runs under
+    # data.lock; pickling and file I/O happen off the caller's thread.
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.last_generation = None
+        self.last_error = None
+        self._requested = threading.Event()
+        self._stopping = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = threading.Thread(target=self._run, name='snapshot-saver', daemon=True)
 
+    def start(self):
+        self._thread.start()
+        return self
+
+    def request(self):
+        self._idle.clear()
+        self._requested.set()
+
+    def wait(self, timeout=None):
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        self._stopping.set()
+        self._requested.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            requested = self._requested.wait(self.interval)
+            if self._stopping.is_set():
+                break
+            self._requested.clear()
+            if requested or self.interval is not None:
+                try:
+                    self.last_generation = write_snapshot_files(capture_snapshot(), quiet=True)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = e
+            if not self._requested.is_set():
+                self._idle.set()
+        self._idle.set()
+
+
+def save_pickles():
+
+    ensure_preprocessed_dir()
+
+    print("Saving preprocessed data (pickle format)...")
+    _dump_pickle('phonebook.pickle', data.phonebook)
+    _dump_pickle('calls.pickle', data.calls)
+    _dump_pickle('call_index.pickle', data.call_index)
+    _dump_pickle('tries.pickle', _tries())
+    _dump_pickle('popularity_graph.pickle', data.popularity_graph)
+    _dump_pickle('blocked.pickle', data.blocked)
+    print("Preprocessed data saved successfully.")
+
+
+def _load_snapshot(name):
+    global _snapshot
+    snap = Snapshot(_path(name))
+
+    store = CallStore()
+    store.numbers = decode_strings(snap['numbers.offsets'], snap['numbers.bytes'])
+    store.number_ids = {number: i for i, number in enumerate(store.numbers)}
+    store.callers = snap['calls.callers']
+    store.callees = snap['calls.callees']
+    store.starts = snap['calls.starts']
+    store.durations = snap['calls.durations']
+    lengths = {len(store.callers), len(store.callees), len(store.starts), len(store.durations), len(snap['calls.timeline'])}
+    if len(lengths) != 1:
+        raise SnapshotError("Call columns in the snapshot have different lengths")
+    calls = SegmentedTimeline(store, snap['calls.timeline'])
+    print(f"  Loaded {len(calls)} calls")
+
+    numbers = store.numbers
+    index_numbers = [numbers[i] for i in snap['index.numbers']]
+    call_index = CallIndex.from_csr(store, index_numbers, snap['index.offsets'], snap['index.rows'])
+    if 'index.pair_keys' in snap.sections:
+        call_index.set_pair_csr(snap['index.pair_keys'], snap['index.pair_offsets'], snap['index.pair_rows'], snap['index.pair_durations'])
+    else:
+        call_index.build_pairs(calls.rows)
+    print(f"  Loaded call index with {len(call_index)} numbers")
+
+    graph_nodes = [numbers[i] for i in snap['graph.nodes']]
+    graph = PopularityGraph.from_columns(graph_nodes, {name: snap[f'graph.{name}'] for name in NODE_COLUMNS + EDGE_COLUMNS})
+    print(f"  Loaded popularity graph with {len(graph)} nodes")
+
+    data.calls = calls
+    data.call_index = call_index
+    data.popularity_graph = graph
+    _snapshot = snap
+
+
+def _load_static_pickles(files):
+    data.phonebook = _load_pickle(files['phonebook'])
+    print(f"  Loaded {len(data.phonebook)} contacts")
+
+    _set_tries(_load_pickle(files['tries']))
+    print("  Loaded tries")
+
+    data.blocked = _load_pickle(files['blocked'])
+    print(f"  Loaded {len(data.blocked)} blocked numbers")
+
+
+def load_preprocessed_static():
+    # First stage of load_preprocessed: the phonebook, tries and blocked
+    # set. Returns the second stage, a function that loads calls, the call
+    # index and the popularity graph and returns False if they have to be
+    # rebuilt from calls.txt; returns None if everything has to be rebuilt
+    # from source.
     if not preprocessed_files_exist():
         print("Preprocessed files not found.")
+        return None
+
+    manifest = read_manifest()
+    if manifest is not None:
+        print(f"Loading preprocessed data (snapshot {manifest['generation']}, {manifest['created_at']})...")
+        if sources_changed(manifest.get('sources'), ('phones', 'blocked')):
+            return None
+        try:
+            _load_static_pickles(manifest['files'])
+        except Exception as e:
+            print(f"Error loading snapshot: {e}")
+            if not pickles_exist():
+                return None
+            print("Falling back to pickle files...")
+        else:
+            data.static_token = manifest['static_token']
+            return lambda: _load_snapshot_calls(manifest)
+
+    if not load_pickled_static():
+        return None
+    return load_pickled_calls
+
+
+def _load_snapshot_calls(manifest):
+    # Checked before loading, so a rewritten calls.txt is rebuilt without
+    # first loading the snapshot it no longer matches.
+    if sources_changed(manifest.get('sources'), ('calls',)):
         return False
-    
-    print("Loading preprocessed data...")
-    
     try:
+        _load_snapshot(manifest['files']['calls'])
+    except Exception as e:
+        print(f"Error loading snapshot: {e}")
+        if not pickles_exist():
+            return False
+        print("Falling back to pickle files...")
+        data.static_token = None
+        return load_pickled_calls()
+    catch_up_calls(manifest.get('sources'))
+    return True
 
-        with open(os.path.join(PREPROCESSED_DIR, 'phonebook.pickle'), 'rb') as f:
-            data.phonebook = pickle.load(f)
-        print(f"  Loaded {len(data.phonebook)} contacts")
-        
 
-        with open(os.path.join(PREPROCESSED_DIR, 'calls.pickle'), 'rb') as f:
-            data.calls = pickle.load(f)
-        print(f"  Loaded {len(data.calls)} calls")
-        
+def load_preprocessed():
 
-        with open(os.path.join(PREPROCESSED_DIR, 'call_index.pickle'), 'rb') as f:
-            data.call_index = pickle.load(f)
-        print(f"  Loaded call index with {len(data.call_index)} numbers")
-        
+    load_calls = load_preprocessed_static()
+    if load_calls is None or not load_calls():
+        return False
+    print("Preprocessed data loaded successfully.")
+    return True
 
-        with open(os.path.join(PREPROCESSED_DIR, 'tries.pickle'), 'rb') as f:
-            tries = pickle.load(f)
-            data.firstname_trie = tries['firstname']
-            data.lastname_trie = tries['lastname']
-            data.phone_trie = tries['phone']
-        print("  Loaded tries")
-        
 
-        with open(os.path.join(PREPROCESSED_DIR, 'popularity_graph.pickle'), 'rb') as f:
-            data.popularity_graph = pickle.load(f)
-        print(f"  Loaded popularity graph with {len(data.popularity_graph.nodes)} nodes")
-        
+def sources_changed(sources, names):
+    # True if one of the named source files was rewritten since the
+    # snapshot (phones.txt and blocked.txt count as changed even if they
+    # only grew); that part then has to be rebuilt from source.
+    if not sources:
+        return False
+    paths = _source_paths()
+    for name in names:
+        status = compare_source(sources[name], paths[name])
+        if status == 'changed' or (status == 'grown' and name != 'calls'):
+            print(f"  {os.path.basename(paths[name])} changed since the snapshot was saved.")
+            return True
+    return False
+
+
+def catch_up_calls(sources):
+    # New lines at the end of calls.txt are parsed and merged into the
+    # loaded data. Run after sources_changed() said calls.txt only grew.
+    if not sources:
+        return
+    from data_load import load_calls_tail
+    path = _source_paths()['calls']
+    if compare_source(sources['calls'], path) == 'grown':
+        offset = sources['calls']['size']
+        print(f"  Catching up on calls.txt from byte {offset}...")
+        merged = load_calls_tail(path, offset)
+        print(f"  Merged {merged} new calls")
+
+
+def load_pickled_static():
+
+    if not pickles_exist():
+        print("Preprocessed files not found.")
+        return False
+
+    print("Loading preprocessed data (pickle format)...")
 
-        with open(os.path.join(PREPROCESSED_DIR, 'blocked.pickle'), 'rb') as f:
-            data.blocked = pickle.load(f)
+    try:
+        data.phonebook = _load_pickle('phonebook.pickle')
+        print(f"  Loaded {len(data.phonebook)} contacts")
+
+        _set_tries(_load_pickle('tries.pickle'))
+        print("  Loaded tries")
+
+        data.blocked = _load_pickle('blocked.pickle')
         print(f"  Loaded {len(data.blocked)} blocked numbers")
-        
-        print("Preprocessed data loaded successfully.")
+
+        data.static_token = None
         return True
-    
+
     except Exception as e:
         print(f"Error loading preprocessed data: {e}")
         return False
+
+
+def load_pickled_calls():
+
+    try:
+        data.calls = _load_pickle('calls.pickle')
+        print(f"  Loaded {len(data.calls)} calls")
+
+        data.call_index = _load_pickle('call_index.pickle')
+        data.call_index.store = data.calls.store
+        if not data.call_index.has_pairs():
+            data.call_index.build_pairs(data.calls.rows)
+        print(f"  Loaded call index with {len(data.call_index)} numbers")
+
+        data.popularity_graph = _load_pickle('popularity_graph.pickle')
+        print(f"  Loaded popularity graph with {len(data.popularity_graph)} nodes")
+        return True
+
+    except Exception as e:
+        print(f"Error loading preprocessed data: {e}")
+        return False
+
+
+def load_pickles():
+
+    if not load_pickled_static() or not load_pickled_calls():
+        return False
+    print("Preprocessed data loaded successfully.")
+    return True
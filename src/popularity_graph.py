@@ -1,63 +1,371 @@
-import networkx as nx
+import heapq
+from array import array
+
 import data
+import metrics
+from snapshot import typecode
+from topk import TopK
+
+NODE_COLUMNS = ('incoming_count', 'outgoing_count', 'incoming_duration', 'outgoing_duration', 'unique_callers', 'unique_callees')
+EDGE_COLUMNS = ('edge_src', 'edge_dst', 'edge_count', 'edge_duration')
+
+# Rankings kept up to date on every recorded call; top(key, n) for n up to
+# TOP_K is answered from them without scanning the graph.
+RANKED = ('incoming_count', 'outgoing_count', 'score')
+TOP_K = 32
+
+# Called with the numbers whose popularity score changed, after each
+# recorded call or merged partial (e.g. to drop cached rankings).
+score_listeners = []
+
+
+class PopularityGraph:
+    # Directed call graph with per-node counters kept in flat arrays indexed
+    # by interned node id, and one entry per (caller, callee) edge. Node ids
+    # follow the order numbers were first seen, like networkx node order.
+    # unique_callers / unique_callees count distinct neighbours; they are
+    # bumped when an edge is created.
+    #
+    # The RANKED top-K sets and the dense score column are built from the
+    # columns on first use and maintained by record() from then on.
+
+    def __init__(self):
+        self.numbers = []
+        self.ids = {}
+        for name in NODE_COLUMNS:
+            setattr(self, name, array('q'))
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_count = array('q')
+        self.edge_duration = array('q')
+        self._edge_ids = {}
+        self._top = None
+        self._scores = None
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        return number in self.ids
+
+    def __getstate__(self):
+        state = {'numbers': self.numbers}
+        for name in NODE_COLUMNS + EDGE_COLUMNS:
+            column = getattr(self, name)
+            state[name] = array(typecode(column), column)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.ids = {number: i for i, number in enumerate(self.numbers)}
+        self._edge_ids = None
+        self._top = None
+        self._scores = None
+
+    @classmethod
+    def from_columns(cls, numbers, columns):
+        # columns may be read-only memoryviews (e.g. from a snapshot); they
+        # are copied into arrays on the first update.
+        graph = cls.__new__(cls)
+        graph.numbers = numbers
+        graph.ids = {number: i for i, number in enumerate(numbers)}
+        for name in NODE_COLUMNS + EDGE_COLUMNS:
+            setattr(graph, name, columns[name])
+        graph._edge_ids = None
+        graph._top = None
+        graph._scores = None
+        return graph
+
+    def columns(self):
+        return {name: getattr(self, name) for name in NODE_COLUMNS + EDGE_COLUMNS}
+
+    def number_of_nodes(self):
+        return len(self.numbers)
+
+    def number_of_edges(self):
+        return len(self.edge_src)
+
+    def _thaw(self):
+        for name in NODE_COLUMNS + EDGE_COLUMNS:
+            column = getattr(self, name)
+            if type(column) is memoryview:
+                setattr(self, name, array(column.format, column))
+        self._edge_ids = {(src << 32) | dst: i for i, (src, dst) in enumerate(zip(self.edge_src, self.edge_dst))}
+
+    def _add_node(self, number):
+        node_id = len(self.numbers)
+        self.numbers.append(number)
+        self.ids[number] = node_id
+        for name in NODE_COLUMNS:
+            getattr(self, name).append(0)
+        if self._scores is not None:
+            self._scores.append(0.0)
+        return node_id
+
+    def node_id(self, number):
+        node_id = self.ids.get(number)
+        if node_id is None:
+            if self._edge_ids is None:
+                self._thaw()
+            node_id = self._add_node(number)
+        return node_id
+
+    def add_edge_totals(self, src, dst, count, duration):
+        key = (src << 32) | dst
+        edge_id = self._edge_ids.get(key)
+        if edge_id is None:
+            self._edge_ids[key] = len(self.edge_src)
+            self.edge_src.append(src)
+            self.edge_dst.append(dst)
+            self.edge_count.append(count)
+            self.edge_duration.append(duration)
+            self.unique_callees[src] += 1
+            self.unique_callers[dst] += 1
+        else:
+            self.edge_count[edge_id] += count
+            self.edge_duration[edge_id] += duration
+
+    def record(self, caller, callee, duration_seconds):
+        edge_ids = self._edge_ids
+        if edge_ids is None:
+            self._thaw()
+            edge_ids = self._edge_ids
+        src = self.ids.get(caller)
+        if src is None:
+            src = self._add_node(caller)
+        dst = self.ids.get(callee)
+        if dst is None:
+            dst = self._add_node(callee)
+
+        self.outgoing_count[src] += 1
+        self.outgoing_duration[src] += duration_seconds
+        self.incoming_count[dst] += 1
+        self.incoming_duration[dst] += duration_seconds
+
+        edge_id = edge_ids.get((src << 32) | dst)
+        if edge_id is None:
+            self.add_edge_totals(src, dst, 1, duration_seconds)
+        else:
+            self.edge_count[edge_id] += 1
+            self.edge_duration[edge_id] += duration_seconds
+
+        scores = self._scores
+        top = self._top
+        if scores is not None or top is not None:
+            src_score = self.score(src)
+            dst_score = self.score(dst)
+            if scores is not None:
+                scores[src] = src_score
+                scores[dst] = dst_score
+            if top is not None:
+                top['outgoing_count'].update(src, self.outgoing_count[src])
+                top['incoming_count'].update(dst, self.incoming_count[dst])
+                top_score = top['score']
+                top_score.update(src, src_score)
+                top_score.update(dst, dst_score)
+
+    def node_data(self, number):
+        node_id = self.ids[number]
+        return {name: getattr(self, name)[node_id] for name in NODE_COLUMNS}
+
+    def edge_data(self, caller, callee):
+        if self._edge_ids is None:
+            self._thaw()
+        src = self.ids.get(caller)
+        dst = self.ids.get(callee)
+        if src is None or dst is None:
+            return None
+        edge_id = self._edge_ids.get((src << 32) | dst)
+        if edge_id is None:
+            return None
+        return {'count': self.edge_count[edge_id], 'duration': self.edge_duration[edge_id]}
+
+    def score(self, node_id):
+        return (self.incoming_count[node_id] * 2.0) + (self.incoming_duration[node_id] / 60.0) + (self.outgoing_count[node_id] * 0.5)
+
+    def scores(self):
+        if self._scores is None:
+            self._scores = array('d', map(self.score, range(len(self.numbers))))
+        return self._scores
+
+    def _values(self, key):
+        if key == 'score':
+            return self.scores()
+        return getattr(self, key)
+
+    def _build_top(self):
+        top = {}
+        for key in RANKED:
+            values = self._values(key)
+            ranking = TopK(TOP_K)
+            for i in heapq.nlargest(TOP_K, range(len(values)), key=values.__getitem__):
+                ranking.update(i, values[i])
+            top[key] = ranking
+        self._top = top
+
+    def top_ids(self, key, n):
+        # Stable like sorted(..., reverse=True): ties keep node order.
+        if key in RANKED and n <= TOP_K:
+            if self._top is None:
+                self._build_top()
+            return self._top[key].top(n)
+        values = self._values(key)
+        return heapq.nlargest(n, range(len(values)), key=values.__getitem__)
+
+    def top(self, key, n):
+        return [(self.numbers[i], self.node_data(self.numbers[i])) for i in self.top_ids(key, n)]
+
+    def to_networkx(self):
+        # For ad-hoc analysis only; builds the graph shape the project used
+        # before (per-node counters plus unique caller/callee sets).
+        import networkx as nx
+        g = nx.DiGraph()
+        numbers = self.numbers
+        for node_id, number in enumerate(numbers):
+            g.add_node(
+                number,
+                incoming_count=self.incoming_count[node_id],
+                outgoing_count=self.outgoing_count[node_id],
+                incoming_duration=self.incoming_duration[node_id],
+                outgoing_duration=self.outgoing_duration[node_id],
+                unique_callers=set(),
+                unique_callees=set(),
+            )
+        for src, dst, count, duration in zip(self.edge_src, self.edge_dst, self.edge_count, self.edge_duration):
+            g.add_edge(numbers[src], numbers[dst], count=count, duration=duration)
+            g.nodes[numbers[src]]['unique_callees'].add(numbers[dst])
+            g.nodes[numbers[dst]]['unique_callers'].add(numbers[src])
+        return g
+
 
 def init_graph():
-    data.popularity_graph = nx.DiGraph()
+    data.popularity_graph = PopularityGraph()
 
+@metrics.timed('graph.update')
 def update_on_call(call):
+    record_call(call.caller, call.callee, call.duration)
+
+
+def record_call(caller, callee, duration):
+    g = data.popularity_graph
+    if g is None:
+        init_graph()
+        g = data.popularity_graph
+    g.record(caller, callee, int(duration))
+    for listener in score_listeners:
+        listener((caller, callee))
+
+
+@metrics.timed('graph.batch')
+def record_calls(records):
+    # Bulk record_call for (caller, callee, duration) records; listeners
+    # hear about the whole batch once.
     g = data.popularity_graph
     if g is None:
         init_graph()
         g = data.popularity_graph
-    caller = call.caller
-    callee = call.callee
-    duration_seconds = int(call.duration)
-    if not g.has_node(caller):
-        g.add_node(caller, incoming_count=0, outgoing_count=0, incoming_duration=0, outgoing_duration=0, unique_callers=set(), unique_callees=set())
-    if not g.has_node(callee):
-        g.add_node(callee, incoming_count=0, outgoing_count=0, incoming_duration=0, outgoing_duration=0, unique_callers=set(), unique_callees=set())
-
-    g.nodes[caller]['outgoing_count'] += 1
-    g.nodes[caller]['outgoing_duration'] += duration_seconds
-    g.nodes[caller]['unique_callees'].add(callee)
-
-    g.nodes[callee]['incoming_count'] += 1
-    g.nodes[callee]['incoming_duration'] += duration_seconds
-    g.nodes[callee]['unique_callers'].add(caller)
-
-    if g.has_edge(caller, callee):
-        g[caller][callee]['count'] += 1
-        g[caller][callee]['duration'] += duration_seconds
+    changed = set()
+    metrics.count('graph.rows', len(records))
+    for caller, callee, duration in records:
+        g.record(caller, callee, int(duration))
+        changed.add(caller)
+        changed.add(callee)
+    for listener in score_listeners:
+        listener(changed)
+
+
+def new_partial():
+    return {}, {}
+
+
+def update_partial(partial, caller, callee, duration_seconds):
+    # Same bookkeeping as update_on_call, but into plain dicts so a worker
+    # process can aggregate a slice of calls.txt without a graph.
+    nodes, edges = partial
+    caller_stats = nodes.get(caller)
+    if caller_stats is None:
+        caller_stats = nodes[caller] = [0, 0, 0, 0]
+    callee_stats = nodes.get(callee)
+    if callee_stats is None:
+        callee_stats = nodes[callee] = [0, 0, 0, 0]
+
+    caller_stats[1] += 1
+    caller_stats[3] += duration_seconds
+    callee_stats[0] += 1
+    callee_stats[2] += duration_seconds
+
+    edge = edges.get((caller, callee))
+    if edge is None:
+        edges[(caller, callee)] = [1, duration_seconds]
     else:
-        g.add_edge(caller, callee, count=1, duration=duration_seconds)
+        edge[0] += 1
+        edge[1] += duration_seconds
+
+
+def merge_partial(partial):
+    # Partials must be merged in file order so nodes and edges are created
+    # in the same order as with per-call update_on_call.
+    g = data.popularity_graph
+    if g is None:
+        init_graph()
+        g = data.popularity_graph
+    if g._edge_ids is None:
+        g._thaw()
+    nodes, edges = partial
+    # Bulk merges bypass record(); rebuild the rankings and scores on the
+    # next query.
+    g._top = None
+    g._scores = None
+    for number, (in_count, out_count, in_duration, out_duration) in nodes.items():
+        node_id = g.node_id(number)
+        g.incoming_count[node_id] += in_count
+        g.outgoing_count[node_id] += out_count
+        g.incoming_duration[node_id] += in_duration
+        g.outgoing_duration[node_id] += out_duration
+
+    ids = g.ids
+    for (caller, callee), (count, duration) in edges.items():
+        g.add_edge_totals(ids[caller], ids[callee], count, duration)
+
+    for listener in score_listeners:
+        listener(nodes.keys())
 
 
 def get_popularity_score(number):
 
+    # While calls load in the background the graph is incomplete and
+    # changing under us; everyone scores 0 until it is done.
     g = data.popularity_graph
-    if g is None or not g.has_node(number):
+    if g is None or not data.calls_ready.is_set():
         return 0.0
-    
-    node_data = g.nodes[number]
-    incoming_count = node_data.get('incoming_count', 0)
-    incoming_duration = node_data.get('incoming_duration', 0)
-    outgoing_count = node_data.get('outgoing_count', 0)
-    
-    score = (incoming_count * 2.0) + (incoming_duration / 60.0) + (outgoing_count * 0.5)
-    return score
+    node_id = g.ids.get(number)
+    if node_id is None:
+        return 0.0
+    return g.score(node_id)
+
+def get_popularity_scores(phones):
+    # Bulk form of get_popularity_score: one pass over the score column.
+    g = data.popularity_graph
+    if g is None or not data.calls_ready.is_set():
+        return [0.0] * len(phones)
+    ids = g.ids.get
+    scores = g.scores()
+    return [0.0 if (node_id := ids(phone)) is None else scores[node_id] for phone in phones]
 
 def get_top_outgoing(n=5):
     g = data.popularity_graph
     if g is None:
         return []
-    nodes = g.nodes(data=True)
-    sorted_nodes = sorted(nodes, key=lambda x: x[1]['outgoing_count'], reverse=True)
-    return sorted_nodes[:n]
+    return g.top('outgoing_count', n)
 
 def get_top_incoming(n=5):
     g = data.popularity_graph
     if g is None:
         return []
-    nodes = g.nodes(data=True)
-    sorted_nodes = sorted(nodes, key=lambda x: x[1]['incoming_count'], reverse=True)
-    return sorted_nodes[:n]
+    return g.top('incoming_count', n)
+
+def get_top_popular(n=5):
+    g = data.popularity_graph
+    if g is None:
+        return []
+    return [(g.numbers[i], g.score(i)) for i in g.top_ids('score', n)]
@@ -0,0 +1,250 @@
+import heapq
+
+# Completions cached per node for top_completions().
+TOP_COMPLETIONS = 8
+
+
+class _Node:
+    # label is the edge from the parent; values is the list stored under
+    # the key ending here (None if no key ends here); count is the number
+    # of values in the whole subtree. top caches the best completions of
+    # the subtree as (-weight, key, values) and best the highest single
+    # value score in it; either is None when stale.
+    __slots__ = ('label', 'children', 'values', 'count', 'top', 'best')
+
+    def __init__(self, label=''):
+        self.label = label
+        self.children = {}
+        self.values = None
+        self.count = 0
+        self.top = None
+        self.best = None
+
+    def __getstate__(self):
+        return (self.label, self.children, self.values, self.count)
+
+    def __setstate__(self, state):
+        self.label, self.children, self.values, self.count = state
+        self.top = None
+        self.best = None
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class RadixTrie:
+    # Compressed trie from string keys to lists of values (one list per
+    # key, appended to with add()). Children are iterated in key order.
+    #
+    # top_completions() ranks the keys under a prefix by a weight computed
+    # from their value lists; each node caches its best TOP_COMPLETIONS.
+    # ranked() yields single values best-first, guided by the highest value
+    # score cached per subtree. invalidate(key) drops the caches on the
+    # key's path when its scores change, and they are recomputed on the
+    # next query that reaches them. The caches assume one weight and one
+    # score function per trie.
+
+    def __init__(self):
+        self.root = _Node()
+        self._keys = 0
+        self._ranked = False
+
+    def __getstate__(self):
+        return {'root': self.root, '_keys': self._keys}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ranked = False
+
+    def __len__(self):
+        return self._keys
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node is not None and node.values is not None
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None or node.values is None:
+            raise KeyError(key)
+        return node.values
+
+    def get(self, key, default=None):
+        node = self._find(key)
+        if node is None or node.values is None:
+            return default
+        return node.values
+
+    def _find(self, key):
+        node = self.root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                return None
+            label = child.label
+            if key.startswith(label, i):
+                i += len(label)
+                node = child
+            else:
+                return None
+        return node
+
+    def _find_prefix(self, prefix):
+        # The node whose subtree holds exactly the keys starting with
+        # prefix, and that node's full key (which may extend prefix).
+        node = self.root
+        i = 0
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                return None, None
+            label = child.label
+            if prefix.startswith(label, i):
+                i += len(label)
+                node = child
+            elif label.startswith(prefix[i:]):
+                return child, prefix[:i] + label
+            else:
+                return None, None
+        return node, prefix
+
+    def add(self, key, value):
+        node = self.root
+        node.count += 1
+        node.top = node.best = None
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                child = node.children[key[i]] = _Node(key[i:])
+                i = len(key)
+            else:
+                label = child.label
+                common = _common_prefix(label, key[i:])
+                if common < len(label):
+                    # Split the edge at the end of the shared part.
+                    middle = _Node(label[:common])
+                    middle.count = child.count
+                    child.label = label[common:]
+                    middle.children[child.label[0]] = child
+                    node.children[key[i]] = middle
+                    child = middle
+                i += common
+            child.count += 1
+            child.top = child.best = None
+            node = child
+        if node.values is None:
+            node.values = []
+            self._keys += 1
+        node.values.append(value)
+
+    def has_rankings(self):
+        return self._ranked
+
+    def invalidate(self, key):
+        if not self._ranked:
+            # No rankings cached yet (e.g. while loading).
+            return
+        node = self.root
+        node.top = node.best = None
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None or not key.startswith(child.label, i):
+                return
+            i += len(child.label)
+            node = child
+            node.top = node.best = None
+
+    def count(self, prefix=''):
+        # Number of values under keys starting with prefix.
+        node, _ = self._find_prefix(prefix)
+        return 0 if node is None else node.count
+
+    def _walk(self, node, key):
+        stack = [(node, key)]
+        while stack:
+            node, key = stack.pop()
+            if node.values is not None:
+                yield key, node.values
+            for first in sorted(node.children, reverse=True):
+                child = node.children[first]
+                stack.append((child, key + child.label))
+
+    def items(self, prefix=''):
+        node, key = self._find_prefix(prefix)
+        if node is None:
+            return iter(())
+        return self._walk(node, key)
+
+    def keys(self, prefix=''):
+        return (key for key, _ in self.items(prefix))
+
+    def _top(self, node, key, weight):
+        if node.top is None:
+            ranked = []
+            if node.values is not None:
+                ranked.append((-weight(node.values), key, node.values))
+            for child in node.children.values():
+                ranked.extend(self._top(child, key + child.label, weight))
+            node.top = heapq.nsmallest(TOP_COMPLETIONS, ranked)
+        return node.top
+
+    def top_completions(self, prefix, n, weight):
+        # [(key, values, weight)] for the n heaviest keys starting with
+        # prefix, ties by key. weight(values) must return a number; n above
+        # TOP_COMPLETIONS falls back to ranking every key.
+        node, key = self._find_prefix(prefix)
+        if node is None:
+            return []
+        self._ranked = True
+        if n > TOP_COMPLETIONS:
+            ranked = heapq.nsmallest(n, ((-weight(values), k, values) for k, values in self._walk(node, key)))
+        else:
+            ranked = self._top(node, key, weight)[:n]
+        return [(k, values, -w) for w, k, values in ranked]
+
+    def _best(self, node, score_values):
+        best = node.best
+        if best is None:
+            best = float('-inf')
+            if node.values is not None:
+                best = max(score_values(node.values))
+            for child in node.children.values():
+                child_best = self._best(child, score_values)
+                if child_best > best:
+                    best = child_best
+            node.best = best
+        return best
+
+    def ranked(self, prefix, score_values):
+        # Yields (value, score) for every value under keys starting with
+        # prefix, highest score first. score_values(values) returns the
+        # scores of a value list. Subtrees are only opened once their best
+        # score could come next, so taking the first few results does not
+        # touch the rest of the matches.
+        node, _ = self._find_prefix(prefix)
+        if node is None:
+            return
+        self._ranked = True
+        heap = [(-self._best(node, score_values), 0, node, None)]
+        seq = 1
+        while heap:
+            neg_score, _, node, value = heapq.heappop(heap)
+            if node is None:
+                yield value, -neg_score
+                continue
+            if node.values is not None:
+                for value, score in zip(node.values, score_values(node.values)):
+                    heapq.heappush(heap, (-score, seq, None, value))
+                    seq += 1
+            for first in sorted(node.children):
+                child = node.children[first]
+                heapq.heappush(heap, (-self._best(child, score_values), seq, child, None))
+                seq += 1
@@ -1,52 +1,148 @@
-import difflib
-from trie import search_firstname_prefix, search_lastname_prefix, search_phone_prefix
-from popularity_graph import get_popularity_score
+from trie import (
+    ranked_firstname_prefix,
+    ranked_lastname_prefix,
+    ranked_phone_prefix,
+    top_firstname_completions,
+    top_lastname_completions,
+)
+from popularity_graph import get_popularity_score, get_popularity_scores
 from data_load import normalize_phone
+import time
+
 import data
+import metrics
+
+DID_YOU_MEAN_MAX_EDITS = 2
+
+
+def _rank_contacts(contacts):
+
+    scores = get_popularity_scores([contact.phone for contact in contacts])
+    contacts_with_scores = list(zip(contacts, scores))
+    contacts_with_scores.sort(key=lambda x: x[1], reverse=True)
+    return contacts_with_scores
+
+
+class SearchResults:
+    # (contact, score) pairs, best first, pulled from a ranked iterator only
+    # as far as they are read. len() is the total number of matches, known
+    # up front from the trie counts.
+    #
+    # The search itself only sets up the iterator, so the ranking work
+    # shows up here: each fetch is timed as "<metric>.page".
+
+    def __init__(self, ranked, total, metric=None):
+        self._ranked = iter(ranked)
+        self._fetched = []
+        self.total = total
+        self._metric = None if metric is None else metric + '.page'
+
+    def __len__(self):
+        return self.total
+
+    def __bool__(self):
+        return self.total > 0
+
+    def _fetch(self, count):
+        fetched = self._fetched
+        if len(fetched) >= count or len(fetched) >= self.total:
+            return
+        if metrics.enabled and self._metric:
+            start = time.perf_counter_ns()
+            try:
+                self._pull(count)
+            finally:
+                metrics.observe(self._metric, time.perf_counter_ns() - start)
+        else:
+            self._pull(count)
+
+    def _pull(self, count):
+        fetched = self._fetched
+        while len(fetched) < count:
+            item = next(self._ranked, None)
+            if item is None:
+                break
+            fetched.append(item)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(self.total)
+            self._fetch(stop)
+            return self._fetched[start:stop:step]
+        if pos < 0:
+            pos += self.total
+        self._fetch(pos + 1)
+        return self._fetched[pos]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self._fetch(i + 1)
+            if i >= len(self._fetched):
+                return
+            yield self._fetched[i]
+            i += 1
+
+    def page(self, number, page_size = 15):
+        return self[number * page_size:(number + 1) * page_size]
 
 
+def _exact_results(trie, name, metric):
+
+    contacts = trie.get(name.lower(), [])
+    return SearchResults(_rank_contacts(contacts), len(contacts), metric)
+
+
+@metrics.timed('search.firstname')
 def search_by_firstname(prefix, exact_match = False):
 
     if not prefix:
         return []
     
-    results = search_firstname_prefix(prefix)
-    
-    # Collect all contacts from all matching keys
-    contacts_with_scores = []
-    for key, contact_list in results:
-        if exact_match and key.lower() != prefix.lower():
-            continue
-        for contact in contact_list:
-            score = get_popularity_score(contact.phone)
-            contacts_with_scores.append((contact, score))
-    
-    contacts_with_scores.sort(key=lambda x: x[1], reverse=True)
+    if exact_match:
+        return _exact_results(data.firstname_trie, prefix, 'search.firstname')
     
-    return contacts_with_scores
+    return SearchResults(*ranked_firstname_prefix(prefix), 'search.firstname')
 
 
+@metrics.timed('search.lastname')
 def search_by_lastname(prefix, exact_match = False):
 
     if not prefix:
         return []
     
-
-    results = search_lastname_prefix(prefix)
-    
-    contacts_with_scores = []
-    for key, contact_list in results:
-        if exact_match and key.lower() != prefix.lower():
-            continue
-        for contact in contact_list:
-            score = get_popularity_score(contact.phone)
-            contacts_with_scores.append((contact, score))
+    if exact_match:
+        return _exact_results(data.lastname_trie, prefix, 'search.lastname')
     
-    contacts_with_scores.sort(key=lambda x: x[1], reverse=True)
+    return SearchResults(*ranked_lastname_prefix(prefix), 'search.lastname')
+
+
+def _search_similar(ngrams, trie, text, limit):
+
+    if not text or ngrams is None:
+        return []
     
-    return contacts_with_scores
+    # Ranked by name similarity first, then by popularity within a name.
+    ranked = []
+    for similarity, name in ngrams.similar(text, limit=limit):
+        for contact, score in _rank_contacts(trie[name]):
+            ranked.append((contact, score))
+    return ranked
+
+
+@metrics.timed('search.similar_firstname')
+def search_similar_firstname(text, limit = 20):
+
+    return _search_similar(data.firstname_ngrams, data.firstname_trie, text, limit)
+
 
+@metrics.timed('search.similar_lastname')
+def search_similar_lastname(text, limit = 20):
 
+    return _search_similar(data.lastname_ngrams, data.lastname_trie, text, limit)
+
+
+@metrics.timed('search.phone')
 def search_by_phone(prefix):
 
     try:
@@ -54,19 +150,10 @@ def search_by_phone(prefix):
     except ValueError:
         return []
     
-    results = search_phone_prefix(normalized_prefix)
-    
-    contacts_with_scores = []
-    for _, contact_list in results:
-        for contact in contact_list:
-            score = get_popularity_score(contact.phone)
-            contacts_with_scores.append((contact, score))
-    
-    contacts_with_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    return contacts_with_scores
+    return SearchResults(*ranked_phone_prefix(normalized_prefix), 'search.phone')
 
 
+@metrics.timed('search.autocomplete')
 def autocomplete_names(prefix, is_firstname = True):
 
     if not prefix:
@@ -74,29 +161,28 @@ def autocomplete_names(prefix, is_firstname = True):
     
 
     if is_firstname:
-        results = search_firstname_prefix(prefix)
+        completions = top_firstname_completions(prefix, 4)
     else:
-        results = search_lastname_prefix(prefix)
-    
-    name_stats = []
-    for complete_name, contact_list in results:
-        contact_count = len(contact_list)
-        total_popularity = sum(get_popularity_score(c.phone) for c in contact_list)
-        name_stats.append((complete_name, contact_count, total_popularity))
+        completions = top_lastname_completions(prefix, 4)
     
-    name_stats.sort(key=lambda x: x[2], reverse=True)
-    return name_stats[:4]
+    return [(complete_name, len(contact_list), total_popularity) for complete_name, contact_list, total_popularity in completions]
 
 
+@metrics.timed('search.did_you_mean')
 def did_you_mean_phone(phone_input):
     try:
         normalized_input = normalize_phone(phone_input)
     except ValueError:
         return []
     
-    all_phones = list(data.phonebook.keys())
-    
-    close_matches = difflib.get_close_matches(normalized_input, all_phones, n=10, cutoff=0.6)
+    # Nearest numbers first; only widen the search when one edit finds
+    # fewer than 10 candidates.
+    close_matches = []
+    for max_edits in range(1, DID_YOU_MEAN_MAX_EDITS + 1):
+        close_matches = data.phone_edit_index.search(normalized_input, max_edits)
+        if len(close_matches) >= 10:
+            break
+    close_matches = [phone for _, phone in close_matches[:10]]
     
     if not close_matches:
         return []
@@ -168,6 +254,12 @@ def prompt_and_search():
                     print(f"Searching for exact name: {prefix}")
         
         results = search_by_firstname(prefix, exact_match=use_exact_match)
+        if not results:
+            results = search_similar_firstname(prefix)
+            if results:
+                print(f"\nNo first names start with '{prefix}'. Similar names:")
+                format_search_results(results)
+                return
         print(f"\nSearch results for first name '{prefix}':")
         format_search_results(results)
     
@@ -195,6 +287,12 @@ def prompt_and_search():
                     print(f"Searching for exact name: {prefix}")
         
         results = search_by_lastname(prefix, exact_match=use_exact_match)
+        if not results:
+            results = search_similar_lastname(prefix)
+            if results:
+                print(f"\nNo last names start with '{prefix}'. Similar names:")
+                format_search_results(results)
+                return
         print(f"\nSearch results for last name '{prefix}':")
         format_search_results(results)
     
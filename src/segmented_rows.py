@@ -0,0 +1,291 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+# Rows per segment after a rebuild; a segment is split in two once it holds
+# twice as many.
+SEGMENT_SIZE = 1024
+
+
+class SegmentedRows:
+    # Row ids kept sorted by key(row) in a list of bounded arrays, so an
+    # insert shifts at most one segment instead of the whole list. maxes
+    # holds the key of each segment's last row for choosing a segment, and
+    # a Fenwick tree over the segment lengths maps positions to segments.
+    # Reads behave like an array('I'): len, iteration, indexing, and slices
+    # returned as arrays.
+    #
+    # key is passed to each call rather than stored, because the columns it
+    # reads from can be replaced (e.g. when a snapshot-backed store thaws).
+    #
+    # For range aggregates, totals() can also keep the sum of weigh(row) (a
+    # tuple of `width` numbers) per segment, with a second Fenwick tree over
+    # those sums. They are built on the first totals() call; insert() and
+    # merge() patch them when given the same weigh and drop them otherwise.
+
+    def __init__(self, rows, key, segment_size=SEGMENT_SIZE):
+        self._segment_size = segment_size
+        self._segments = [array('I', rows[i:i + segment_size]) for i in range(0, len(rows), segment_size)]
+        self._maxes = [key(segment[-1]) for segment in self._segments]
+        self._len = len(rows)
+        self._build_tree()
+        self._totals = None
+        self._total_tree = None
+
+    def _build_tree(self):
+        tree = [0] * (len(self._segments) + 1)
+        for i, segment in enumerate(self._segments, start=1):
+            tree[i] += len(segment)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _build_total_tree(self):
+        totals = self._totals
+        width = len(totals[0]) if totals else 0
+        tree = [[0] * width for _ in range(len(totals) + 1)]
+        for i, total in enumerate(totals, start=1):
+            node = tree[i]
+            for k in range(width):
+                node[k] += total[k]
+            parent = i + (i & -i)
+            if parent < len(tree):
+                parent_node = tree[parent]
+                for k in range(width):
+                    parent_node[k] += node[k]
+        self._total_tree = tree
+
+    def _tree_add(self, i, delta):
+        tree = self._tree
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _offset(self, i):
+        # Number of rows in the segments before segment i.
+        tree = self._tree
+        total = 0
+        while i:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _sum(self, rows, weigh, width):
+        total = [0] * width
+        for row in rows:
+            for k, value in enumerate(weigh(row)):
+                total[k] += value
+        return total
+
+    def totals(self, pos, weigh, width):
+        # Sums of weigh(row) over the first pos rows, as a list.
+        if self._totals is None:
+            self._totals = [self._sum(segment, weigh, width) for segment in self._segments]
+            self._build_total_tree()
+        if pos >= self._len:
+            i, offset = len(self._segments), 0
+        else:
+            i, offset = self._locate(pos)
+        result = [0] * width
+        tree = self._total_tree
+        j = i
+        while j:
+            node = tree[j]
+            for k in range(width):
+                result[k] += node[k]
+            j -= j & -j
+        if offset:
+            # Scan the shorter side of the segment.
+            segment = self._segments[i]
+            if offset <= len(segment) // 2:
+                partial = self._sum(segment[:offset], weigh, width)
+            else:
+                rest = self._sum(segment[offset:], weigh, width)
+                partial = [total - value for total, value in zip(self._totals[i], rest)]
+            for k in range(width):
+                result[k] += partial[k]
+        return result
+
+    def _patch_totals(self, weigh):
+        # True if the totals are kept and can be patched with weigh.
+        if self._totals is None:
+            return False
+        if weigh is None:
+            self._totals = self._total_tree = None
+            return False
+        return True
+
+    def _locate(self, pos):
+        # (segment, offset in it) for 0 <= pos < len(self).
+        tree = self._tree
+        i = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = i + step
+            if nxt < len(tree) and tree[nxt] <= pos:
+                i = nxt
+                pos -= tree[nxt]
+            step >>= 1
+        return i, pos
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._segments)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(self._len)
+            if step != 1:
+                return array('I', self)[pos]
+            result = array('I')
+            if start >= stop:
+                return result
+            i, offset = self._locate(start)
+            remaining = stop - start
+            segments = self._segments
+            while remaining:
+                piece = segments[i][offset:offset + remaining]
+                result.extend(piece)
+                remaining -= len(piece)
+                i += 1
+                offset = 0
+            return result
+        if pos < 0:
+            pos += self._len
+        if not 0 <= pos < self._len:
+            raise IndexError('SegmentedRows index out of range')
+        if pos == self._len - 1:
+            return self._segments[-1][-1]
+        i, offset = self._locate(pos)
+        return self._segments[i][offset]
+
+    def bisect_left(self, value, key):
+        # Position of the first row with key(row) >= value.
+        i = bisect_left(self._maxes, value)
+        if i == len(self._segments):
+            return self._len
+        return self._offset(i) + bisect_left(self._segments[i], value, key=key)
+
+    def bisect_right(self, value, key):
+        # Position after the last row with key(row) <= value.
+        i = bisect_right(self._maxes, value)
+        if i == len(self._segments):
+            return self._len
+        return self._offset(i) + bisect_right(self._segments[i], value, key=key)
+
+    def insert(self, row, key, weigh=None):
+        # Like insort_right: after any rows with the same key.
+        value = key(row)
+        segments = self._segments
+        patch = self._patch_totals(weigh)
+        if not segments:
+            segments.append(array('I', (row,)))
+            self._maxes.append(value)
+            self._len = 1
+            self._build_tree()
+            if patch:
+                self._totals = [list(weigh(row))]
+                self._build_total_tree()
+            return
+        i = bisect_right(self._maxes, value)
+        if i == len(segments):
+            i -= 1
+            segments[i].append(row)
+            self._maxes[i] = value
+        else:
+            segment = segments[i]
+            segment.insert(bisect_right(segment, value, key=key), row)
+        self._len += 1
+        if patch:
+            weights = weigh(row)
+            total = self._totals[i]
+            for k, weight in enumerate(weights):
+                total[k] += weight
+        if len(segments[i]) > 2 * self._segment_size:
+            self._split(i, key, weigh if patch else None)
+            return
+        self._tree_add(i, 1)
+        if patch:
+            tree = self._total_tree
+            j = i + 1
+            while j < len(tree):
+                node = tree[j]
+                for k, weight in enumerate(weights):
+                    node[k] += weight
+                j += j & -j
+
+    def _split(self, i, key, weigh=None):
+        segment = self._segments[i]
+        half = len(segment) // 2
+        self._segments[i:i + 1] = [segment[:half], segment[half:]]
+        self._maxes[i:i + 1] = [key(segment[half - 1]), key(segment[-1])]
+        self._build_tree()
+        if weigh is not None:
+            total = self._totals[i]
+            first = self._sum(segment[:half], weigh, len(total))
+            self._totals[i:i + 1] = [first, [a - b for a, b in zip(total, first)]]
+            self._build_total_tree()
+
+    def merge(self, new_rows, key, weigh=None):
+        # new_rows must be sorted by key; same result as inserting them one
+        # at a time, with one merge per touched segment and one tree rebuild.
+        if not new_rows:
+            return
+        segments = self._segments
+        maxes = self._maxes
+        size = self._segment_size
+        totals = self._totals if self._patch_totals(weigh) else None
+        if totals is not None:
+            width = len(totals[0]) if totals else len(weigh(new_rows[0]))
+        if not segments or key(new_rows[0]) >= maxes[-1]:
+            # Everything goes after the current end.
+            rows = array('I', new_rows)
+            if segments and len(segments[-1]) < size:
+                room = size - len(segments[-1])
+                segments[-1].extend(rows[:room])
+                maxes[-1] = key(segments[-1][-1])
+                if totals is not None:
+                    added = self._sum(rows[:room], weigh, width)
+                    totals[-1] = [a + b for a, b in zip(totals[-1], added)]
+                rows = rows[room:]
+            for start in range(0, len(rows), size):
+                segment = rows[start:start + size]
+                segments.append(segment)
+                maxes.append(key(segment[-1]))
+                if totals is not None:
+                    totals.append(self._sum(segment, weigh, width))
+        else:
+            last = len(segments) - 1
+            batches = {}
+            i = 0
+            for row in new_rows:
+                i = min(bisect_right(maxes, key(row), lo=i), last)
+                batch = batches.get(i)
+                if batch is None:
+                    batch = batches[i] = []
+                batch.append(row)
+            # Back to front, so splitting a segment does not move the
+            # segments still to be merged.
+            for i in sorted(batches, reverse=True):
+                # Stable sort of two sorted runs keeps existing rows ahead
+                # of new ones with the same key.
+                merged = array('I', sorted(chain(segments[i], batches[i]), key=key))
+                if len(merged) > 2 * size:
+                    pieces = [merged[start:start + size] for start in range(0, len(merged), size)]
+                    if totals is not None:
+                        totals[i:i + 1] = [self._sum(piece, weigh, width) for piece in pieces]
+                else:
+                    pieces = [merged]
+                    if totals is not None:
+                        added = self._sum(batches[i], weigh, width)
+                        totals[i] = [a + b for a, b in zip(totals[i], added)]
+                segments[i:i + 1] = pieces
+                maxes[i:i + 1] = [key(piece[-1]) for piece in pieces]
+        self._len += len(new_rows)
+        self._build_tree()
+        if totals is not None:
+            self._build_total_tree()
@@ -5,9 +5,13 @@ from datetime import datetime, timedelta
 
 import data
 from call import Call
-from data_load import append_call_to_file
-from index import add_call_sorted
-from popularity_graph import update_on_call
+from call_store import to_epoch
+from data_load import append_call_to_file, append_records_to_file
+from index import add_call_sorted, add_records_sorted
+from popularity_graph import record_calls, update_on_call
+from topk import TopK
+
+BATCH_SIZE = 2000
 
 
 def run_overload_simulation(duration_seconds = 60, enable_controls = True):
@@ -29,15 +33,32 @@ def run_overload_simulation(duration_seconds = 60, enable_controls = True):
     blocked_calls = 0
 
     sim_stats = {}
+    sim_ids = {}
+    sim_numbers = []
+    sim_top = TopK(5)
+
+    def _stats(num):
+        st = sim_stats.get(num)
+        if st is None:
+            st = sim_stats[num] = {"incoming_count": 0, "outgoing_count": 0, "incoming_duration": 0}
+            sim_ids[num] = len(sim_numbers)
+            sim_numbers.append(num)
+        return st
+
+    def _rank(num, st):
+        score = st["incoming_count"] * 2.0 + (st["incoming_duration"] / 60.0) + st["outgoing_count"] * 0.5
+        sim_top.update(sim_ids[num], score)
 
     def _bump_incoming(num, dur):
-        st = sim_stats.setdefault(num, {"incoming_count": 0, "outgoing_count": 0, "incoming_duration": 0})
+        st = _stats(num)
         st["incoming_count"] += 1
         st["incoming_duration"] += int(dur)
+        _rank(num, st)
 
     def _bump_outgoing(num):
-        st = sim_stats.setdefault(num, {"incoming_count": 0, "outgoing_count": 0, "incoming_duration": 0})
+        st = _stats(num)
         st["outgoing_count"] += 1
+        _rank(num, st)
 
 
     start_wall = datetime.now()
@@ -119,10 +140,10 @@ def run_overload_simulation(duration_seconds = 60, enable_controls = True):
             duration=duration
         )
 
-        add_call_sorted(call, data.calls, data.call_index)
-        update_on_call(call)
-
-        append_call_to_file(call)
+        with data.lock:
+            add_call_sorted(call, data.calls, data.call_index)
+            update_on_call(call)
+            append_call_to_file(call)
 
         _bump_outgoing(caller)
         _bump_incoming(callee, duration)
@@ -138,12 +159,7 @@ def run_overload_simulation(duration_seconds = 60, enable_controls = True):
     avg_s = avg_duration_secs % 60
 
 
-    scored = []
-    for number, st in sim_stats.items():
-        score = st["incoming_count"] * 2.0 + (st["incoming_duration"] / 60.0) + st["outgoing_count"] * 0.5
-        scored.append((number, score))
-    scored.sort(key=lambda x: x[1], reverse=True)
-    top5 = scored[:5]
+    top5 = [(sim_numbers[i], sim_top.members[i]) for i in sim_top.top(5)]
 
     print(f"{'='*60}")
     print("SIMULATION COMPLETE")
@@ -160,3 +176,111 @@ def run_overload_simulation(duration_seconds = 60, enable_controls = True):
     else:
         print("  (none)")
     print(f"{'='*60}\n")
+
+
+def _generate_batch(all_numbers, size, base_epoch, duration_seconds):
+    callers = random.choices(all_numbers, k=size)
+    callees = random.choices(all_numbers, k=size)
+    for i in range(size):
+        while callees[i] == callers[i]:
+            callees[i] = random.choice(all_numbers)
+    durations = random.choices(range(10, 301), k=size)
+    offsets = random.choices(range(max(1, duration_seconds)), k=size)
+    return [(caller, callee, base_epoch + offset, duration) for caller, callee, offset, duration in zip(callers, callees, offsets, durations)]
+
+
+def run_batched_simulation(duration_seconds = 60, target_rate = None, batch_size = BATCH_SIZE):
+
+    # Same call mix as run_overload_simulation, generated and committed a
+    # batch at a time: one merge into calls/index, one graph update pass and
+    # one write to calls.txt per batch. target_rate (calls per second)
+    # caps how many calls have been generated at any point, so batches
+    # shrink to what is due; None runs as fast as possible.
+    print(f"\n{'='*60}")
+    print("STARTING BATCHED OVERLOAD SIMULATION")
+    rate_text = f"{target_rate} calls/s" if target_rate else "unlimited"
+    print(f"Batch size: {batch_size}, target rate: {rate_text}  (Ctrl+C to stop)")
+    print(f"{'='*60}\n")
+
+    all_numbers = list(data.phonebook.keys())
+    if len(all_numbers) < 2:
+        print("[ERROR] Need at least 2 contacts in phonebook to simulate calls.")
+        return
+
+    blocked = data.blocked
+    base_epoch = to_epoch(datetime.now().replace(second=0, microsecond=0))
+    stages = {"generate": 0.0, "filter": 0.0, "sort": 0.0, "merge": 0.0, "graph": 0.0, "write": 0.0}
+    total_generated = 0
+    successful_calls = 0
+    blocked_calls = 0
+    total_duration = 0
+
+    start = time.perf_counter()
+    try:
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration_seconds:
+                break
+            size = batch_size
+            if target_rate:
+                # Only the calls due by now, at most a batch; sleep until
+                # the next one is due if none are.
+                size = min(batch_size, int(target_rate * elapsed) - total_generated)
+                if size <= 0:
+                    next_due = (total_generated + 1) / target_rate
+                    time.sleep(min(next_due - elapsed, duration_seconds - elapsed))
+                    continue
+
+            t0 = time.perf_counter()
+            batch = _generate_batch(all_numbers, size, base_epoch, duration_seconds)
+            t1 = time.perf_counter()
+            records = [r for r in batch if r[0] not in blocked and r[1] not in blocked]
+            t2 = time.perf_counter()
+            records.sort(key=lambda r: r[2])
+            t3 = time.perf_counter()
+            with data.lock:
+                add_records_sorted(records, data.calls, data.call_index)
+                t4 = time.perf_counter()
+                record_calls([(caller, callee, duration) for caller, callee, _, duration in records])
+                t5 = time.perf_counter()
+                append_records_to_file(records)
+            t6 = time.perf_counter()
+
+            stages["generate"] += t1 - t0
+            stages["filter"] += t2 - t1
+            stages["sort"] += t3 - t2
+            stages["merge"] += t4 - t3
+            stages["graph"] += t5 - t4
+            stages["write"] += t6 - t5
+            total_generated += len(batch)
+            successful_calls += len(records)
+            blocked_calls += len(batch) - len(records)
+            total_duration += sum(r[3] for r in records)
+            print(f" {total_generated}", end="", flush=True)
+    except KeyboardInterrupt:
+        print("\n[STOP REQUESTED]")
+
+    wall = time.perf_counter() - start
+    print(" Done!\n")
+
+    avg_duration_secs = (total_duration // successful_calls) if successful_calls else 0
+    avg_h = avg_duration_secs // 3600
+    avg_m = (avg_duration_secs % 3600) // 60
+    avg_s = avg_duration_secs % 60
+    busy = sum(stages.values())
+
+    print(f"{'='*60}")
+    print("BATCHED SIMULATION COMPLETE")
+    print(f"{'='*60}")
+    print(f"Total calls generated:  {total_generated}")
+    print(f"Successful (OK) calls:  {successful_calls}")
+    print(f"Blocked calls:          {blocked_calls}")
+    print(f"Average duration (OK):  {avg_h:02d}:{avg_m:02d}:{avg_s:02d}")
+    print(f"Achieved rate:          {total_generated / wall if wall else 0:.0f} calls/s over {wall:.1f}s")
+    if busy:
+        print(f"Peak rate (busy time):  {total_generated / busy:.0f} calls/s")
+    print("Stage timings:")
+    for stage, seconds in stages.items():
+        share = (seconds / busy * 100) if busy else 0.0
+        print(f"  {stage:<9} {seconds:8.3f}s  {share:5.1f}%")
+    print(f"{'='*60}\n")
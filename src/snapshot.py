@@ -0,0 +1,112 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+# Binary snapshot layout (native byte order, checked on load):
+#   header:  magic(8) version(u32) byteorder-mark(u32) section-count(u32) pad(u32)
+#   table:   per section name(24, ascii, NUL padded) typecode(1) pad(7) offset(u64) count(u64)
+#   data:    each section's items, starting on an 8-byte boundary
+MAGIC = b'TCSNAP\0\0'
+VERSION = 2
+_BOM = 0x01020304
+_HEADER = struct.Struct('=8sIIII')
+_ENTRY = struct.Struct('=24sc7xQQ')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def typecode(column):
+    return column.format if type(column) is memoryview else column.typecode
+
+
+def _align(pos):
+    return (pos + 7) & ~7
+
+
+def write_snapshot(path, sections):
+    # sections: list of (name, typecode, buffer) where buffer is an array or
+    # a memoryview cast to typecode. Written to a temporary file and moved
+    # into place so a reader never sees a partial snapshot.
+    table = []
+    pos = _align(_HEADER.size + _ENTRY.size * len(sections))
+    for name, typecode, buf in sections:
+        view = memoryview(buf)
+        if view.format != typecode:
+            raise SnapshotError(f"Section '{name}' has format '{view.format}', expected '{typecode}'")
+        table.append((name, typecode, pos, len(view), view))
+        pos = _align(pos + view.nbytes)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, _BOM, len(table), 0))
+        for name, typecode, offset, count, _view in table:
+            f.write(_ENTRY.pack(name.encode('ascii'), typecode.encode('ascii'), offset, count))
+        for _name, _typecode, offset, _count, view in table:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(view.cast('B'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    # A snapshot file opened with mmap. Sections are zero-copy memoryviews
+    # into the mapping, so the object must outlive every view taken from it.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.sections = {}
+        self._read_table()
+
+    def _read_table(self):
+        if len(self._view) < _HEADER.size:
+            raise SnapshotError(f"Snapshot '{self.path}' is truncated")
+        magic, version, bom, count, _pad = _HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"'{self.path}' is not a snapshot file")
+        if version != VERSION:
+            raise SnapshotError(f"Snapshot version {version} is not supported (expected {VERSION})")
+        if bom != _BOM:
+            raise SnapshotError(f"Snapshot '{self.path}' was written with a different byte order ({sys.byteorder} here)")
+
+        for i in range(count):
+            raw_name, raw_code, offset, items = _ENTRY.unpack_from(self._view, _HEADER.size + i * _ENTRY.size)
+            name = raw_name.rstrip(b'\0').decode('ascii')
+            typecode = raw_code.decode('ascii')
+            end = offset + items * struct.calcsize(typecode)
+            if end > len(self._view):
+                raise SnapshotError(f"Section '{name}' runs past the end of '{self.path}'")
+            self.sections[name] = self._view[offset:end].cast(typecode)
+
+    def __getitem__(self, name):
+        try:
+            return self.sections[name]
+        except KeyError:
+            raise SnapshotError(f"Snapshot '{self.path}' has no section '{name}'")
+
+    def __contains__(self, name):
+        return name in self.sections
+
+
+def encode_strings(strings):
+    offsets = array('q', [0])
+    chunks = []
+    total = 0
+    for s in strings:
+        encoded = s.encode('utf-8')
+        chunks.append(encoded)
+        total += len(encoded)
+        offsets.append(total)
+    return offsets, array('B', b''.join(chunks))
+
+
+def decode_strings(offsets, blob):
+    text = bytes(blob)
+    return [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
@@ -0,0 +1,92 @@
+import functools
+import threading
+import time
+
+import data
+
+# Staged startup: the phonebook, tries and blocked set are loaded on the
+# main thread so the menu can open, and calls, the call index and the
+# popularity graph follow on a background thread. data.calls_ready is
+# clear until they are in place; menu actions that need them go through
+# needs_calls().
+
+_loader = None
+
+# One line saying how the background load went; shown by the menu at its
+# next redraw rather than printed over whatever prompt is up.
+_notice = None
+
+
+def load_calls_in_background(load, rebuild=None, on_ready=None):
+    # load() fills data.calls, data.call_index and data.popularity_graph and
+    # returns False if they could not be loaded; rebuild() is then tried
+    # instead. on_ready() runs on the loader thread once the data is usable.
+    global _loader
+    data.calls_error = None
+    data.calls_ready.clear()
+    _loader = threading.Thread(target=_run, args=(load, rebuild, on_ready), name='call-loader', daemon=True)
+    _loader.start()
+    return _loader
+
+
+def _run(load, rebuild, on_ready):
+    global _notice
+
+    started = time.perf_counter()
+    try:
+        rebuilt = ""
+        loaded = load()
+        if loaded is False:
+            if rebuild is None:
+                raise RuntimeError("preprocessed call data could not be loaded")
+            rebuilt = ", rebuilt from source"
+            rebuild()
+        if on_ready is not None:
+            on_ready()
+        _notice = f"Call history ready: {len(data.calls)} calls{rebuilt} ({time.perf_counter() - started:.1f}s)"
+    except Exception as e:
+        data.calls_error = e
+        _notice = f"Error loading call history: {e}"
+    finally:
+        # Whatever happened, nobody may be left waiting for it.
+        data.calls_ready.set()
+
+
+def take_notice():
+    # The loader's notice, once; None while loading or after it was shown.
+    global _notice
+    if not data.calls_ready.is_set():
+        return None
+    notice, _notice = _notice, None
+    return notice
+
+
+def is_loading():
+    return not data.calls_ready.is_set()
+
+
+def wait_for_calls():
+    # True once call data can be used; if it is still loading, says so and
+    # blocks until it is.
+    if not data.calls_ready.is_set():
+        print("Call history is still loading; this will start once it is ready (Ctrl+C to go back)...")
+        try:
+            data.calls_ready.wait()
+        except KeyboardInterrupt:
+            print("\nCancelled.")
+            return False
+        notice = take_notice()
+        if notice is not None and data.calls_error is None:
+            print(notice)
+    if data.calls_error is not None:
+        print(f"Call history is not available: {data.calls_error}")
+        return False
+    return True
+
+
+def needs_calls(action):
+    @functools.wraps(action)
+    def wrapper(*args, **kwargs):
+        if wait_for_calls():
+            return action(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,304 @@
+import asyncio
+import heapq
+import random
+from collections import deque
+from itertools import count
+
+import data
+from call import Call
+from call_store import from_epoch
+
+
+class VirtualClock:
+    # Simulated time for asyncio tasks. Tasks wait through sleep() or
+    # wait(); once every task registered with spawn() is waiting, run()
+    # jumps the clock to the next timer instead of sleeping through the
+    # gap. With speed set, each jump is also paced at speed x real time.
+
+    def __init__(self, speed=None):
+        self.now = 0.0
+        self.speed = speed
+        self._timers = []
+        self._seq = count()
+        self._tasks = 0
+        self._waiting = 0
+        self._error = None
+
+    def spawn(self, coro):
+        self._tasks += 1
+        task = asyncio.get_running_loop().create_task(coro)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks -= 1
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+
+    def call_at(self, when, callback):
+        # Returns a handle for cancel().
+        timer = [when, next(self._seq), callback]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        # A cancelled timer is dropped without moving the clock.
+        timer[2] = None
+
+    async def wait(self, future):
+        # Waits for a future that is resolved through wake().
+        self._waiting += 1
+        return await future
+
+    def wake(self, future, result=None):
+        if not future.done():
+            self._waiting -= 1
+            future.set_result(result)
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        self.call_at(self.now + delay, lambda: self.wake(future))
+        await self.wait(future)
+
+    async def run(self):
+        while self._tasks:
+            if self._error is not None:
+                raise self._error
+            if self._waiting < self._tasks:
+                # Someone can still make progress at the current time.
+                await asyncio.sleep(0)
+                continue
+            if not self._timers:
+                raise RuntimeError("Switchboard deadlock: every task is waiting and no timer is pending")
+            when, _, callback = heapq.heappop(self._timers)
+            if callback is None:
+                continue
+            if self.speed and when > self.now:
+                await asyncio.sleep((when - self.now) / self.speed)
+            self.now = max(self.now, when)
+            callback()
+        if self._error is not None:
+            raise self._error
+
+
+class SwitchboardStats:
+
+    def __init__(self, trunks, queue_size):
+        self.trunks = trunks
+        self.queue_size = queue_size
+        self.offered = 0
+        self.connected = 0
+        self.blocked_numbers = 0
+        self.line_busy = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.waits = []
+        self.peak_concurrent = 0
+        self.peak_queue = 0
+        self.busy_trunk_seconds = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def blocking_probability(self):
+        # Share of calls that reached the switchboard but never got a
+        # trunk (rejected with the queue full, or gave up waiting).
+        contending = self.offered - self.blocked_numbers - self.line_busy
+        if contending <= 0:
+            return 0.0
+        return (self.rejected + self.abandoned) / contending
+
+    def wait_percentile(self, p):
+        if not self.waits:
+            return 0.0
+        waits = sorted(self.waits)
+        return waits[min(len(waits) - 1, int(p / 100.0 * len(waits)))]
+
+    def print_report(self):
+        utilization = (self.busy_trunk_seconds / (self.trunks * self.elapsed) * 100) if self.elapsed else 0.0
+        print(f"{'='*60}")
+        print("SWITCHBOARD REPORT")
+        print(f"{'='*60}")
+        print(f"Trunks / queue size:    {self.trunks} / {self.queue_size}")
+        print(f"Simulated time:         {self.elapsed:.0f}s")
+        print(f"Calls offered:          {self.offered}")
+        print(f"Connected:              {self.connected}")
+        print(f"Blocked numbers:        {self.blocked_numbers}")
+        print(f"Line busy (party busy): {self.line_busy}")
+        print(f"Rejected (no trunk):    {self.rejected}")
+        print(f"Abandoned in queue:     {self.abandoned}")
+        print(f"Blocking probability:   {self.blocking_probability * 100:.2f}%")
+        print(f"Queue wait p50/p90/p99: {self.wait_percentile(50):.1f}s / {self.wait_percentile(90):.1f}s / {self.wait_percentile(99):.1f}s")
+        print(f"Peak concurrent calls:  {self.peak_concurrent}")
+        print(f"Peak queue length:      {self.peak_queue}")
+        print(f"Trunk utilization:      {utilization:.1f}%")
+        print(f"{'='*60}\n")
+
+
+class Switchboard:
+    # A pool of trunk lines shared by all calls. A call whose caller or
+    # callee is blocked is refused, and so is one to or from a number that
+    # is already on a call (line busy). Otherwise it takes a free trunk,
+    # or waits in a FIFO queue of queue_size places for up to max_wait
+    # seconds (None waits forever), or is rejected when the queue is full.
+
+    def __init__(self, trunks, queue_size=0, max_wait=None, blocked=None, speed=None):
+        if trunks < 1:
+            raise ValueError("A switchboard needs at least one trunk line")
+        if queue_size < 0:
+            raise ValueError("Queue size cannot be negative")
+        if max_wait is not None and max_wait < 0:
+            raise ValueError("Max queue wait cannot be negative")
+        self.clock = VirtualClock(speed)
+        self.free_trunks = trunks
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.blocked = data.blocked if blocked is None else blocked
+        self.stats = SwitchboardStats(trunks, queue_size)
+        self.completed = []
+        self._queue = deque()
+        self._engaged = set()
+        self._in_progress = 0
+
+    async def _call(self, caller, callee, duration):
+        clock = self.clock
+        stats = self.stats
+        stats.offered += 1
+        if caller in self.blocked or callee in self.blocked:
+            stats.blocked_numbers += 1
+            return
+        if caller in self._engaged or callee in self._engaged:
+            stats.line_busy += 1
+            return
+
+        arrived = clock.now
+        if self.free_trunks:
+            self.free_trunks -= 1
+        elif len(self._queue) >= self.queue_size:
+            stats.rejected += 1
+            return
+        else:
+            self._engaged.update((caller, callee))
+            future = asyncio.get_running_loop().create_future()
+            self._queue.append(future)
+            stats.peak_queue = max(stats.peak_queue, len(self._queue))
+            give_up = None
+            if self.max_wait is not None:
+                give_up = clock.call_at(arrived + self.max_wait, lambda: self._give_up(future))
+            got_trunk = await clock.wait(future)
+            if give_up is not None:
+                # Served (or gone): the patience timer must not move the
+                # clock later on.
+                clock.cancel(give_up)
+            if not got_trunk:
+                self._engaged.difference_update((caller, callee))
+                stats.abandoned += 1
+                return
+        stats.waits.append(clock.now - arrived)
+
+        self._engaged.update((caller, callee))
+        self._in_progress += 1
+        stats.connected += 1
+        stats.peak_concurrent = max(stats.peak_concurrent, self._in_progress)
+        connected = clock.now
+        await clock.sleep(duration)
+        self._in_progress -= 1
+        self._engaged.difference_update((caller, callee))
+        stats.busy_trunk_seconds += duration
+        self.completed.append((caller, callee, connected, duration))
+        self._release()
+
+    def _give_up(self, future):
+        if not future.done():
+            self._queue.remove(future)
+            self.clock.wake(future, False)
+
+    def _release(self):
+        # Hand the trunk straight to the longest waiting call, if any.
+        if self._queue:
+            self.clock.wake(self._queue.popleft(), True)
+        else:
+            self.free_trunks += 1
+
+    async def _feed(self, arrivals):
+        clock = self.clock
+        for offset, caller, callee, duration in arrivals:
+            if offset > clock.now:
+                await clock.sleep(offset - clock.now)
+            clock.spawn(self._call(caller, callee, duration))
+
+    async def _run(self, arrivals):
+        self.clock.spawn(self._feed(arrivals))
+        await self.clock.run()
+        self.stats.elapsed = self.clock.now
+
+    def run(self, arrivals):
+        # arrivals: (offset seconds, caller, callee, duration seconds),
+        # ordered by offset.
+        asyncio.run(self._run(arrivals))
+        return self.stats
+
+    def completed_calls(self, start_epoch):
+        # Connected calls as Call objects, with simulated time 0 at
+        # start_epoch.
+        return [Call(caller, callee, from_epoch(start_epoch + int(connected)), duration) for caller, callee, connected, duration in self.completed]
+
+
+def arrivals_from_history(calls, limit=None):
+    # Replays the real call mix: the last `limit` calls of a timeline,
+    # with their start times shifted so the first one arrives at 0.
+    if limit is not None and limit < 1:
+        raise ValueError("Replay at least one call")
+    rows = calls.rows
+    if limit is not None:
+        rows = rows[-limit:]
+    store = calls.store
+    numbers = store.numbers
+    if not rows:
+        return []
+    first = store.starts[rows[0]]
+    return [(store.starts[row] - first, numbers[store.callers[row]], numbers[store.callees[row]], store.durations[row]) for row in rows]
+
+
+def poisson_arrivals(numbers, rate, duration_seconds, mean_hold):
+    # Random calls at `rate` per second with exponential hold times.
+    arrivals = []
+    t = random.expovariate(rate)
+    while t < duration_seconds:
+        caller, callee = random.sample(numbers, 2)
+        arrivals.append((t, caller, callee, max(1, int(random.expovariate(1.0 / mean_hold)))))
+        t += random.expovariate(rate)
+    return arrivals
+
+
+def prompt_and_run_switchboard():
+
+    try:
+        trunks = int(input("Trunk lines: ").strip())
+        queue_size = int(input("Queue places (0 for none): ").strip() or 0)
+        max_wait_text = input("Max queue wait in seconds (Enter for no limit): ").strip()
+        max_wait = float(max_wait_text) if max_wait_text else None
+        limit_text = input("Replay how many recent calls (Enter for all): ").strip()
+        limit = int(limit_text) if limit_text else None
+    except ValueError:
+        print("Invalid number.")
+        return
+    except KeyboardInterrupt:
+        print("\nCancelled.")
+        return
+
+    try:
+        arrivals = arrivals_from_history(data.calls, limit)
+        switchboard = Switchboard(trunks, queue_size=queue_size, max_wait=max_wait)
+    except ValueError as e:
+        print(f"Invalid input: {e}")
+        return
+    if not arrivals:
+        print("No calls to replay.")
+        return
+    print(f"\nReplaying {len(arrivals)} calls through {trunks} trunks...")
+    try:
+        stats = switchboard.run(arrivals)
+    except RuntimeError as e:
+        print(f"Simulation stopped: {e}")
+        return
+    stats.print_report()
@@ -0,0 +1,57 @@
+class TopK:
+    # Keeps the `capacity` members with the largest values, for values that
+    # only ever grow (call counters, popularity scores). Ties are broken in
+    # favour of the smaller member id, matching a stable sort over ids.
+    #
+    # A member outside the set can only get in when its value is updated,
+    # so update() is O(1) unless the member beats the current floor; then
+    # the floor is recomputed in O(capacity).
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.members = {}
+        self._floor_member = None
+        self._floor_value = float('-inf')
+
+    def __len__(self):
+        return len(self.members)
+
+    def update(self, member, value):
+        members = self.members
+        if member in members:
+            members[member] = value
+            if member == self._floor_member:
+                self._floor_member = None
+            return
+        if value < self._floor_value:
+            return
+        self._admit(member, value)
+
+    def _find_floor(self):
+        floor_member = None
+        floor_value = None
+        for member, value in self.members.items():
+            if floor_member is None or value < floor_value or (value == floor_value and member > floor_member):
+                floor_member, floor_value = member, value
+        self._floor_member = floor_member
+        self._floor_value = floor_value
+
+    def _admit(self, member, value):
+        members = self.members
+        if len(members) < self.capacity:
+            members[member] = value
+            if len(members) == self.capacity:
+                self._find_floor()
+            return
+        if self._floor_member is None:
+            self._find_floor()
+        floor_member = self._floor_member
+        floor_value = self._floor_value
+        if value > floor_value or (value == floor_value and member < floor_member):
+            del members[floor_member]
+            members[member] = value
+            self._find_floor()
+
+    def top(self, n):
+        members = self.members
+        return sorted(members, key=lambda member: (-members[member], member))[:n]
@@ -1,22 +1,17 @@
+from itertools import islice
+
 import data
+import popularity_graph
+from popularity_graph import get_popularity_scores
 
 def insert_firstname(name, contact):
-    key = name.lower()
-    if key not in data.firstname_trie:
-        data.firstname_trie[key] = []
-    data.firstname_trie[key].append(contact)
+    data.firstname_trie.add(name.lower(), contact)
 
 def insert_lastname(name, contact):
-    key = name.lower()
-    if key not in data.lastname_trie:
-        data.lastname_trie[key] = []
-    data.lastname_trie[key].append(contact)
+    data.lastname_trie.add(name.lower(), contact)
 
 def insert_phone(phone, contact):
-    key = phone
-    if key not in data.phone_trie:
-        data.phone_trie[key] = []
-    data.phone_trie[key].append(contact)
+    data.phone_trie.add(phone, contact)
 
 def search_firstname_prefix(prefix):
     return list(data.firstname_trie.items(prefix=prefix.lower()))
@@ -26,3 +21,61 @@ def search_lastname_prefix(prefix):
 
 def search_phone_prefix(prefix):
     return list(data.phone_trie.items(prefix=prefix))
+
+
+def contact_popularity(contacts):
+    return get_popularity_scores([contact.phone for contact in contacts])
+
+def _unranked(trie, prefix):
+    # Until call history has loaded every score is 0, and rankings cached
+    # now would go stale once it has: key order, nothing cached.
+    return ((contact, 0.0) for _, contacts in trie.items(prefix) for contact in contacts)
+
+def _ranked(trie, prefix):
+    if not data.calls_ready.is_set():
+        return _unranked(trie, prefix), trie.count(prefix)
+    return trie.ranked(prefix, contact_popularity), trie.count(prefix)
+
+def ranked_firstname_prefix(prefix):
+    return _ranked(data.firstname_trie, prefix.lower())
+
+def ranked_lastname_prefix(prefix):
+    return _ranked(data.lastname_trie, prefix.lower())
+
+def ranked_phone_prefix(prefix):
+    return _ranked(data.phone_trie, prefix)
+
+
+def completion_popularity(contacts):
+    return sum(get_popularity_scores([contact.phone for contact in contacts]))
+
+def _top_completions(trie, prefix, n):
+    if not data.calls_ready.is_set():
+        return [(key, contacts, 0.0) for key, contacts in islice(trie.items(prefix), n)]
+    return trie.top_completions(prefix, n, completion_popularity)
+
+def top_firstname_completions(prefix, n):
+    return _top_completions(data.firstname_trie, prefix.lower(), n)
+
+def top_lastname_completions(prefix, n):
+    return _top_completions(data.lastname_trie, prefix.lower(), n)
+
+
+def _on_scores_changed(numbers):
+    # Completion rankings cache popularity sums; drop the ones that
+    # include a contact whose score just changed.
+    phonebook = data.phonebook
+    if not phonebook:
+        return
+    tries = (data.firstname_trie, data.lastname_trie, data.phone_trie)
+    if not any(trie.has_rankings() for trie in tries):
+        return
+    for number in numbers:
+        contact = phonebook.get(number)
+        if contact is None:
+            continue
+        data.firstname_trie.invalidate(contact.first_name.lower())
+        data.lastname_trie.invalidate(contact.last_name.lower())
+        data.phone_trie.invalidate(number)
+
+popularity_graph.score_listeners.append(_on_scores_changed)
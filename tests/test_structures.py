@@ -0,0 +1,199 @@
+# Checks the hand-rolled structures and the fast call parser against
+# brute-force references on random input.
+from bisect import bisect_left, bisect_right, insort_right
+from datetime import datetime
+import random
+
+import pytest
+
+from call_store import to_epoch
+from data_load import PhoneNormalizationError, _parse_call_line_strptime, parse_call_record
+from radix_trie import RadixTrie
+from segmented_rows import SegmentedRows
+from topk import TopK
+
+SEEDS = range(5)
+
+
+def _check_rows(rows, expected, keys, durations, rng):
+    key = keys.__getitem__
+    assert len(rows) == len(expected)
+    assert list(rows) == expected
+    for pos in range(len(expected)):
+        assert rows[pos] == expected[pos]
+    if expected:
+        assert rows[-1] == expected[-1]
+    for _ in range(20):
+        start = rng.randrange(-3, len(expected) + 3)
+        stop = rng.randrange(-3, len(expected) + 3)
+        assert list(rows[start:stop]) == expected[start:stop]
+    expected_keys = [key(row) for row in expected]
+    for value in range(-1, 102):
+        assert rows.bisect_left(value, key) == bisect_left(expected_keys, value)
+        assert rows.bisect_right(value, key) == bisect_right(expected_keys, value)
+    for pos in {0, len(expected), rng.randrange(len(expected) + 1), rng.randrange(len(expected) + 1)}:
+        head = expected[:pos]
+        assert rows.totals(pos, lambda row: (1, durations[row]), 2) == [len(head), sum(durations[row] for row in head)]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_segmented_rows_match_a_sorted_list(seed):
+    rng = random.Random(seed)
+    keys = []
+    durations = []
+
+    def new_row():
+        # Few distinct keys, so ties and runs across segments are common.
+        keys.append(rng.randrange(50))
+        durations.append(rng.randrange(1000))
+        return len(keys) - 1
+
+    key = keys.__getitem__
+    weigh = lambda row: (1, durations[row])  # noqa: E731
+    initial = sorted((new_row() for _ in range(rng.randrange(12))), key=key)
+    rows = SegmentedRows(initial, key, segment_size=4)
+    expected = list(initial)
+    for _ in range(60):
+        op = rng.random()
+        if op < 0.5:
+            row = new_row()
+            # Without weigh the totals are dropped and rebuilt on the next
+            # totals() call; with it they are patched in place.
+            rows.insert(row, key, weigh if op < 0.4 else None)
+            insort_right(expected, row, key=key)
+        else:
+            batch = sorted((new_row() for _ in range(rng.randrange(1, 15))), key=key)
+            if op > 0.9:
+                # Everything after the current end.
+                for row in batch:
+                    keys[row] += 50
+            rows.merge(batch, key, weigh if op < 0.8 else None)
+            for row in batch:
+                insort_right(expected, row, key=key)
+        _check_rows(rows, expected, keys, durations, rng)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_topk_matches_sorted(seed):
+    rng = random.Random(seed)
+    capacity = rng.randrange(1, 8)
+    top = TopK(capacity)
+    values = {}
+    for _ in range(500):
+        member = rng.randrange(30)
+        # Values only grow; small steps keep plenty of ties.
+        values[member] = values.get(member, 0) + rng.randrange(3)
+        top.update(member, values[member])
+        expected = sorted(values, key=lambda m: (-values[m], m))
+        assert top.top(capacity) == expected[:capacity]
+        assert top.top(2) == expected[:min(2, capacity)]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_radix_trie_ranked_matches_sorted(seed):
+    rng = random.Random(seed)
+    trie = RadixTrie()
+    entries = []
+    scores = {}
+    for value in range(300):
+        key = ''.join(rng.choice('ab') for _ in range(rng.randrange(1, 7)))
+        trie.add(key, value)
+        entries.append((key, value))
+        scores[value] = rng.randrange(40)
+
+    def score_values(values):
+        return [scores[value] for value in values]
+
+    prefixes = ['', 'a', 'b', 'ab', 'ba', 'aab', 'bbbb', 'abab', 'c']
+    for round_ in range(3):
+        for prefix in prefixes:
+            matches = [(value, scores[value]) for key, value in entries if key.startswith(prefix)]
+            ranked = list(trie.ranked(prefix, score_values))
+            assert sorted(ranked) == sorted(matches)
+            assert [score for _, score in ranked] == sorted((score for _, score in matches), reverse=True)
+            assert trie.count(prefix) == len(matches)
+            # Stopping early gives the best scores too.
+            first = [score for _, (_, score) in zip(range(5), trie.ranked(prefix, score_values))]
+            assert first == [score for _, score in ranked[:5]]
+        # Change some scores and drop the cached bests on their paths.
+        for key, value in rng.sample(entries, 20):
+            scores[value] += rng.randrange(-10, 60)
+            trie.invalidate(key)
+
+
+def _reference(line):
+    # The strptime parser, with the start time as epoch seconds.
+    try:
+        result = _parse_call_line_strptime(line)
+    except (PhoneNormalizationError, ValueError) as e:
+        return type(e)
+    if result is None:
+        return None
+    caller, callee, timestamp, duration_secs = result
+    return caller, callee, to_epoch(timestamp), duration_secs
+
+
+def _fast(line):
+    try:
+        return parse_call_record(line)
+    except (PhoneNormalizationError, ValueError) as e:
+        return type(e)
+
+
+MALFORMED = [
+    '',
+    '   ',
+    '# 0612345678, 0698765432, 04.09.2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 07:28:02',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 00:03:15, extra',
+    '0612345678,, 04.09.2025 07:28:02, 00:03:15',
+    '06123x5678, 0698765432, 04.09.2025 07:28:02, 00:03:15',
+    '+31 6-1234 5678, 0698765432, 04.09.2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 31.02.2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 29.02.2024 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 4.9.2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 24:00:00, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 23:59:60, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 7:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025  07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025T07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04-09-2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.0000 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 3:15',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 0:03:15',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 100:00:00',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 00:99:99',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, -1:00:00',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 01:-1:00',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, +1:00:00',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, aa:bb:cc',
+    '0612345678, 0698765432, ٠٤.09.2025 07:28:02, 00:03:15',
+    '0612345678, 0698765432, 04.09.2025 07:28:02, 00:03:١٥',
+]
+
+
+@pytest.mark.parametrize('line', MALFORMED)
+def test_fast_parser_matches_strptime_on_edge_cases(line):
+    assert _fast(line) == _reference(line)
+
+
+def test_fast_parser_matches_strptime_on_mangled_lines():
+    rng = random.Random(0)
+    pool = '0123456789 :.,-+#x٣\t'
+    for _ in range(20000):
+        when = datetime(2025, 1, 1).replace(
+            month=rng.randrange(1, 13), day=rng.randrange(1, 29),
+            hour=rng.randrange(24), minute=rng.randrange(60), second=rng.randrange(60))
+        chars = list(f"06{rng.randrange(10 ** 8):08d}, 06{rng.randrange(10 ** 8):08d}, "
+                     f"{when:%d.%m.%Y %H:%M:%S}, {rng.randrange(3):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}")
+        for _ in range(rng.randrange(3)):
+            pos = rng.randrange(len(chars))
+            edit = rng.randrange(3)
+            if edit == 0:
+                chars[pos] = rng.choice(pool)
+            elif edit == 1:
+                chars.insert(pos, rng.choice(pool))
+            else:
+                del chars[pos]
+        line = ''.join(chars)
+        assert _fast(line) == _reference(line), line